@@ -0,0 +1,218 @@
+"""
+Caching shared by the worker processes.
+
+The versions and locks here live in the default cache, which must be shared
+by every process (memcached or redis, see CACHES); with a per-process cache
+each worker has versions of its own and never sees the others' bumps.
+"""
+
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def bump_around_commit(bump):
+    """
+    Runs bump now, for the reads of the transaction, and again once it commits:
+    a process reading the old rows in between would store what it rendered
+    under the first new version, and keep serving it until the next bump.
+    """
+    bump()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump)
+
+
+class ContentVersion:
+    """
+    A version in the shared cache for keys that must change together with some content.
+
+    Putting the version in a key makes every process, and every local copy
+    in TwoTierCache, move to the new value as soon as the version is bumped.
+    The version never expires, so it takes the cache shared by the processes
+    (see CACHES): with a per-process one a worker keeps its own version, and
+    answers conditional requests with 304 for content changed elsewhere.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def get(self):
+        return self.state()[0]
+
+    def state(self):
+        """Returns (version, time of the bump that set it)."""
+        state = cache.get(self.key)
+        if state is None:
+            cache.add(self.key, (uuid.uuid4().hex, time.time()), None)
+            state = cache.get(self.key)
+        if state is None:
+            # the cache is down, a version of its own matches no validator sent before
+            return uuid.uuid4().hex, time.time()
+        return state
+
+    def bump(self):
+        bump_around_commit(lambda: cache.set(self.key, (uuid.uuid4().hex, time.time()), None))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+class TwoTierCache:
+    """
+    A size-bounded LRU in each process in front of the shared Django cache.
+
+    get_or_set() recomputes a missing or expired value once: threads of a
+    process wait on the one computing it, and processes take a lock key in the
+    shared cache, serving the stale value (or waiting for the fresh one) while
+    another process holds it. Values are refreshed early with probability
+    growing towards expiry, scaled by how long they took to compute (XFetch),
+    so a hot key is usually recomputed before it expires at all.
+
+    The local copies are kept for BLOG_LOCAL_CACHE_TTL seconds at most, which
+    bounds how stale a value deleted in another process can be.
+    """
+    lock_prefix = 'blog:lock:'
+
+    def __init__(self, backend=None, max_size=None, local_ttl=None, beta=1.0, lock_timeout=10):
+        self.backend = backend or cache
+        self._max_size = max_size
+        self._local_ttl = local_ttl
+        self.beta = beta
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+        self._flights = {}
+        self.counters = Counter()
+
+    @property
+    def max_size(self):
+        return self._max_size or getattr(settings, 'BLOG_LOCAL_CACHE_SIZE', 1024)
+
+    @property
+    def local_ttl(self):
+        return self._local_ttl if self._local_ttl is not None else getattr(settings, 'BLOG_LOCAL_CACHE_TTL', 5)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _early(self, entry, now):
+        value, delta, expiry = entry
+        return now - delta * self.beta * math.log(1.0 - random.random()) >= expiry
+
+    def _local_get(self, key, now):
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            entry, expiry = item
+            if now >= expiry:
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return entry
+
+    def _local_set(self, key, entry, now):
+        with self._lock:
+            self._local[key] = (entry, min(now + self.local_ttl, entry[2]))
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def get_or_set(self, key, compute, timeout):
+        now = time.time()
+        entry = self._local_get(key, now)
+        if entry is not None and not self._early(entry, now):
+            self._count('local_hits')
+            return entry[0]
+        if entry is None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                self._local_set(key, entry, now)
+                if not self._early(entry, now):
+                    self._count('hits')
+                    return entry[0]
+        return self._recompute(key, compute, timeout, entry)
+
+    def _recompute(self, key, compute, timeout, stale):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._count('coalesced')
+            if stale is not None:
+                return stale[0]
+            if flight.done.wait(self.lock_timeout) and flight.entry is not None:
+                return flight.entry[0]
+            return compute()
+        try:
+            flight.entry = self._compute_shared(key, compute, timeout, stale)
+            return flight.entry[0]
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _compute_shared(self, key, compute, timeout, stale):
+        lock_key = self.lock_prefix + key
+        locked = self.backend.add(lock_key, 1, self.lock_timeout)
+        # a lock no process holds is a cache that is down, computed right away rather than waited on
+        if not locked and self.backend.get(lock_key) is not None:
+            if stale is not None:
+                self._count('coalesced')
+                return stale
+            deadline = time.time() + self.lock_timeout
+            while time.time() < deadline:
+                time.sleep(0.05)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self._count('coalesced')
+                    self._local_set(key, entry, time.time())
+                    return entry
+        self._count('misses')
+        try:
+            start = time.time()
+            value = compute()
+            now = time.time()
+            entry = (value, now - start, now + timeout)
+            self.backend.set(key, entry, timeout)
+            self._local_set(key, entry, now)
+            return entry
+        finally:
+            if locked:
+                self.backend.delete(lock_key)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+        self.backend.delete_many(keys)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, size=len(self._local))
+
+
+tiered_cache = TwoTierCache()
+
+# bumped by blog.signals when posts are added, removed or retagged, or categories and tags change
+sidebar_version = ContentVersion('blog:sidebar:version')
+
+# bumped by blog.signals on every write to what the pages show, validates conditional requests
+content_version = ContentVersion('blog:content:version')
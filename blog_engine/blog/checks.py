@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# backends keeping their entries in each process
+PER_PROCESS = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """The page cache, versions and view buffer only work across workers with a cache they share."""
+    if settings.CACHES['default']['BACKEND'] in PER_PROCESS:
+        return [Warning(
+            'The default cache is not shared between processes.',
+            hint='Pages, ETags and view counts go stale in the other workers, set BLOG_MEMCACHED_LOCATION '
+                 'or CACHES to memcached or redis.',
+            id='blog.W001',
+        )]
+    return []
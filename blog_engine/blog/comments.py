@@ -0,0 +1,58 @@
+from collections import namedtuple, defaultdict
+
+from django.conf import settings
+from django.templatetags.static import static
+
+from .models import Comment, Reply
+
+CommentThread = namedtuple('CommentThread', ['comments', 'next_cursor'])
+
+DEFAULT_AVATAR = 'images/users/default-user-image.jpg'
+
+
+def avatar_url(profile):
+    try:
+        return '/' + profile.image_cropped.url if profile.image_cropped else static(DEFAULT_AVATAR)
+    except (IOError, ValueError):
+        return static(DEFAULT_AVATAR)
+
+
+def load_comments(post_id, before=None, limit=None):
+    """
+    Loads a page of comments with their replies and authors in two queries.
+
+    Comments are paged newest first by id and returned oldest first; pass
+    next_cursor back as `before` to get the previous page. Every author gets a
+    single Profile instance with avatar_url resolved once, however many
+    comments and replies they wrote.
+    """
+    limit = limit or getattr(settings, 'BLOG_COMMENTS_PAGE_SIZE', 20)
+    comments = Comment.objects.filter(post_id=post_id).select_related('author__user').order_by('-id')
+    if before:
+        comments = comments.filter(id__lt=before)
+    comments = list(comments[:limit + 1])
+    has_more = len(comments) > limit
+    comments = comments[:limit][::-1]
+
+    replies = defaultdict(list)
+    if comments:
+        for reply in Reply.objects.filter(comment__in=[c.id for c in comments]) \
+                .select_related('author__user').order_by('id'):
+            replies[reply.comment_id].append(reply)
+
+    profiles = {}
+
+    def author(item):
+        if item.author_id not in profiles:
+            item.author.avatar_url = avatar_url(item.author)
+            profiles[item.author_id] = item.author
+        item.author = profiles[item.author_id]
+
+    for comment in comments:
+        author(comment)
+        comment.thread_replies = replies[comment.id]
+        for reply in comment.thread_replies:
+            author(reply)
+            reply.comment = comment
+
+    return CommentThread(comments, comments[0].id if has_more else None)
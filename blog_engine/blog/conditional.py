@@ -0,0 +1,53 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .cache import content_version
+
+
+class ConditionalGetMixin:
+    """
+    Answers conditional GETs with 304 Not Modified without running the view.
+
+    The ETag is a hash of the content version, the URL, the user and
+    etag_extra(); Last-Modified is the time of the last bump of the content
+    version. Both are known before rendering, at the cost of one read of the
+    cache shared by the workers, which must be shared for them to agree.
+    Pages show who is logged in, so responses vary on Cookie and are private
+    for logged in users; views the same for everyone return False from
+    per_user() and stay cacheable by shared caches. not_modified() runs for
+    every 304.
+    """
+
+    def per_user(self, request):
+        return True
+
+    def etag_extra(self, request, *args, **kwargs):
+        return ''
+
+    def not_modified(self, request, *args, **kwargs):
+        pass
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        version, modified = content_version.state()
+        per_user = self.per_user(request)
+        user = request.user.pk if per_user and request.user.is_authenticated else ''
+        key = ':'.join(str(part) for part in (version, request.get_full_path(), user,
+                                              self.etag_extra(request, *args, **kwargs)))
+        etag = '"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+        response = get_conditional_response(request, etag=etag, last_modified=int(modified))
+        if response is not None:
+            self.not_modified(request, *args, **kwargs)
+        else:
+            response = super().dispatch(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(modified)
+        if per_user:
+            patch_vary_headers(response, ('Cookie',))
+        if user:
+            patch_cache_control(response, private=True)
+        return response
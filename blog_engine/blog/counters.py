@@ -0,0 +1,20 @@
+from django.db.models import Count, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+
+from .models import Post, Category, Comment
+
+
+def _count(queryset, field):
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def recount_posts(ids):
+    """Sets comments_count and likes_count of the posts from the rows, in one UPDATE."""
+    return Post.objects.filter(id__in=ids).update(comments_count=_count(Comment.objects.all(), 'post'),
+                                                  likes_count=_count(Post.likes.through.objects.all(), 'post'))
+
+
+def recount_categories(ids):
+    """Sets posts_count of the categories from the rows, in one UPDATE."""
+    return Category.objects.filter(id__in=ids).update(posts_count=_count(Post.objects.all(), 'category'))
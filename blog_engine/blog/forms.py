@@ -5,6 +5,7 @@ from transliterate import translit
 from django.utils.text import slugify
 from time import time
 from .models import *
+from .uploads import UploadedImageField
 
 
 class CategoryForm(forms.ModelForm):
@@ -17,6 +18,7 @@ class CategoryForm(forms.ModelForm):
             'slug': forms.widgets.Input(attrs={'class': 'form-control'}),
             'cover': forms.widgets.FileInput(attrs={'class': 'form-control-file'}),
         }
+        field_classes = {'cover': UploadedImageField}
 
     def clean_slug(self):
         slug = self.cleaned_data['slug']
@@ -64,6 +66,7 @@ class PostForm(forms.ModelForm):
             'slug': forms.widgets.HiddenInput(attrs={'class': 'form-control', 'value': 'slug'}),
             'author': forms.widgets.HiddenInput(attrs={'class': 'form-control'})
         }
+        field_classes = {'cover': UploadedImageField}
 
     # def clean_cover(self):
     #     if self.cleaned_data['cover'] is None:
@@ -145,7 +148,7 @@ class RegisterForm(forms.Form):
     full_name = forms.CharField(max_length=100, widget=forms.widgets.Input(attrs={'class': 'form-control'}))
     password = forms.CharField(widget=forms.widgets.PasswordInput(attrs={'class': 'form-control'}))
     confirm_password = forms.CharField(widget=forms.widgets.PasswordInput(attrs={'class': 'form-control'}))
-    image = forms.ImageField(required=False, widget=forms.widgets.FileInput(attrs={'class': 'form-control-file'}))
+    image = UploadedImageField(required=False, widget=forms.widgets.FileInput(attrs={'class': 'form-control-file'}))
 
     def clean_username(self):
         if User.objects.filter(username=self.cleaned_data['username']).count():
@@ -191,8 +194,8 @@ class UpdateUserForm(forms.Form):
                                    required=False)
     confirm_password = forms.CharField(widget=forms.widgets.PasswordInput(attrs={'class': 'form-control'}),
                                        required=False)
-    image = forms.ImageField(required=False,
-                             widget=forms.widgets.FileInput(attrs={'class': 'form-control-file'}))
+    image = UploadedImageField(required=False,
+                               widget=forms.widgets.FileInput(attrs={'class': 'form-control-file'}))
 
     def clean_username(self):
         if self.cleaned_data['username'] != self.cleaned_data['old_username'] and \
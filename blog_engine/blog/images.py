@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from imagekit import hashers
+from imagekit.cachefiles.namers import source_name_as_path
+from imagekit.models import ImageSpecField
+from pilkit.utils import suggest_extension
+
+from .processors import DraftResizeToFill, DraftResizeToFit
+from .storage import content_digest
+
+# (name, Pillow format, MIME type, save options), <picture> offers them in this order
+FORMATS = [
+    ('avif', 'AVIF', 'image/avif', {'quality': 60}),
+    ('webp', 'WEBP', 'image/webp', {'quality': 80}),
+    ('jpeg', 'JPEG', 'image/jpeg', {'quality': 85, 'progressive': True}),
+]
+
+# model: (source field, [(width, format name, spec name), ...]), filled by responsive()
+RESPONSIVE = {}
+
+DIGEST_KEY = 'blog:image:digest:'
+
+
+def responsive(model, source, widths, aspect=None):
+    """
+    Adds an imagekit spec named <source>_<width>_<format> to the model for
+    every width and format, cropped to the aspect (width, height) or scaled
+    down to the width when there is none.
+    """
+    renditions = []
+    for width in widths:
+        if aspect:
+            processor = DraftResizeToFill(width, round(width * aspect[1] / aspect[0]))
+        else:
+            processor = DraftResizeToFit(width, upscale=False)
+        for name, image_format, mime_type, options in FORMATS:
+            spec_name = '{}_{}_{}'.format(source, width, name)
+            model.add_to_class(spec_name, ImageSpecField(source=source, processors=[processor], format=image_format,
+                                                         options=options))
+            renditions.append((width, name, spec_name))
+    RESPONSIVE[model] = (source, renditions)
+
+
+def source_digest(source):
+    """Hash of the content of an image, cached by its name since uploads never overwrite a file."""
+    digest = content_digest(source.name)
+    if digest:
+        return digest
+    key = DIGEST_KEY + hashlib.md5(source.name.encode()).hexdigest()
+    digest = cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with source.storage.open(source.name) as f:
+            for chunk in f.chunks():
+                sha.update(chunk)
+        digest = sha.hexdigest()[:32]
+        cache.set(key, digest, None)
+    return digest
+
+
+def content_hash_namer(generator):
+    """
+    Names a rendition by the content of its source and by the spec, so a
+    rendition never changes under its name and can be cached forever, and
+    the same image uploaded twice shares its renditions.
+    """
+    source = generator.source
+    try:
+        digest = source_digest(source)
+    except (OSError, ValueError):
+        return source_name_as_path(generator)
+    spec = hashers.pickle([generator.processors, generator.format, generator.options, generator.autoconvert])
+    return os.path.join(settings.IMAGEKIT_CACHEFILE_DIR, digest[:2],
+                        '{}-{}{}'.format(digest, spec[:12], suggest_extension('', generator.format)))
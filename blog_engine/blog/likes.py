@@ -0,0 +1,54 @@
+from django.db import IntegrityError, transaction
+from django.db.models.signals import m2m_changed
+
+from .models import Post, Profile
+
+Like = Post.likes.through
+
+
+def _changed(post_id, profile_id, action):
+    # the same signals post.likes.add()/remove() send, pre_ before the write and
+    # post_ after it, so the receivers in blog.signals keep counters, trending
+    # scores and caches up to date
+    m2m_changed.send(sender=Like, instance=Post(id=post_id), action=action, reverse=False,
+                     model=Profile, pk_set={profile_id}, using='default')
+
+
+def _add(post_id, profile_id):
+    # sent before the insert, even when the unique constraint then finds the like there
+    _changed(post_id, profile_id, 'pre_add')
+    try:
+        with transaction.atomic():
+            Like.objects.create(post_id=post_id, profile_id=profile_id)
+    except IntegrityError:
+        return False
+    _changed(post_id, profile_id, 'post_add')
+    return True
+
+
+def _remove(post_id, profile_id):
+    # sent whether or not there is a like to delete, as remove() does
+    _changed(post_id, profile_id, 'pre_remove')
+    if not Like.objects.filter(post_id=post_id, profile_id=profile_id).delete()[0]:
+        return False
+    _changed(post_id, profile_id, 'post_remove')
+    return True
+
+
+def set_like(post_id, profile_id, liked=None):
+    """
+    Likes or unlikes the post for the profile, or toggles the like when liked is None.
+
+    The row in the likes table is inserted or deleted as is: its unique
+    constraint settles concurrent requests, so setting the state twice is a
+    no-op and a toggle never leaves two likes behind. Returns (liked, likes count).
+    """
+    with transaction.atomic():
+        if liked is None:
+            liked = not _remove(post_id, profile_id)
+        elif not liked:
+            _remove(post_id, profile_id)
+        if liked:
+            _add(post_id, profile_id)
+        count = Post.objects.filter(id=post_id).values_list('likes_count', flat=True).get()
+    return liked, count
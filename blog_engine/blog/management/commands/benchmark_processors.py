@@ -0,0 +1,60 @@
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from pilkit.processors import ResizeToFill
+
+from blog.processors import DraftResizeToFill
+
+PROCESSORS = {
+    'pilkit': ResizeToFill,
+    'draft': DraftResizeToFill,
+}
+
+# the sizes of the post cover and avatar renditions
+SIZES = [(800, 534), (1900, 1267), (256, 256)]
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def _run(processor, size, paths, runs):
+    """Seconds taken and peak KiB of memory used above what it started with, run in a fresh process."""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = perf_counter()
+    for _ in range(runs):
+        for path in paths:
+            with Image.open(path) as img:
+                PROCESSORS[processor](*size).process(img).load()
+    return perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+
+
+class Command(BaseCommand):
+    help = 'Compares the time and peak memory the rendition processors take on a corpus of images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['static/images'],
+                            help='images, or directories searched for JPEG and PNG images')
+        parser.add_argument('--runs', type=int, default=3, help='times every image is processed')
+
+    def handle(self, *args, **options):
+        paths = []
+        for path in options['paths']:
+            if os.path.isdir(path):
+                paths += sorted(os.path.join(root, name) for root, dirs, names in os.walk(path)
+                                for name in names if name.lower().endswith(EXTENSIONS))
+            else:
+                paths.append(path)
+        if not paths:
+            raise CommandError('No images found')
+        self.stdout.write('{} images, {} runs'.format(len(paths), options['runs']))
+        self.stdout.write('{:<12}{:<10}{:>10}{:>14}'.format('size', 'processor', 'seconds', 'peak MiB'))
+        for size in SIZES:
+            for processor in PROCESSORS:
+                # a fresh process each, so the peak is not left over from the one before
+                with ProcessPoolExecutor(1) as pool:
+                    seconds, peak = pool.submit(_run, processor, size, paths, options['runs']).result()
+                self.stdout.write('{:<12}{:<10}{:>10.3f}{:>14.1f}'.format(
+                    '{}x{}'.format(*size), processor, seconds, peak / 1024))
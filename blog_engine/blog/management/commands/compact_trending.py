@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from blog.trending import trending, WINDOWS
+
+
+class Command(BaseCommand):
+    help = 'Rescales trending scores to the current time and drops the ones that decayed away'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', action='append', choices=list(WINDOWS))
+        parser.add_argument('--seed', action='store_true',
+                            help='Fill the all-time window from current views, likes and comments first')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            trending.seed()
+        dropped = trending.compact(options['window'])
+        self.stdout.write('Dropped {} decayed scores'.format(dropped))
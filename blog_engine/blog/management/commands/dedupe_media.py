@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+
+from blog.storage import content_digest, images
+
+
+class Command(BaseCommand):
+    help = 'Moves uploaded images stored before blog.storage to names by their content, storing duplicates once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='report what would be done, change nothing')
+
+    def handle(self, *args, **options):
+        moved = duplicates = missing = freed = 0
+        # names stored so far, a dry run does not store them
+        stored = set()
+        for model, field in images.fields():
+            default = model._meta.get_field(field).default
+            names = (model._default_manager.exclude(**{field: ''}).exclude(**{field: default})
+                     .values_list(field, flat=True).distinct())
+            for name in list(names):
+                if content_digest(name):
+                    continue
+                if not images.exists(name):
+                    missing += 1
+                    continue
+                with images.open(name) as f:
+                    new = images.content_name(name, f)
+                    duplicate = new in stored or images.exists(new)
+                    if not options['dry_run'] and not duplicate:
+                        images.save(name, f)
+                stored.add(new)
+                moved += 1
+                if duplicate:
+                    duplicates += 1
+                    freed += images.size(name)
+                if options['dry_run']:
+                    continue
+                with transaction.atomic():
+                    for other_model, other_field in images.fields():
+                        other_model._default_manager.filter(**{other_field: name}).update(**{other_field: new})
+                images.delete(name)
+        self.stdout.write('Moved {} images, {} duplicates freeing {}, {} missing{}'.format(
+            moved, duplicates, filesizeformat(freed), missing, ' (dry run)' if options['dry_run'] else ''))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.pageviews import counter
+
+
+class Command(BaseCommand):
+    """
+    Drains the view buffer of every post, whichever worker counted the views.
+
+    The buffer is in the default cache, so this only sees the workers' views
+    with the cache shared by the processes (see CACHES); with a per-process
+    cache it flushes nothing and only the workers' own threads drain it.
+    """
+    help = 'Writes buffered post views to the database, needs the cache shared with the web workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+        flushed = 0
+        for i in range(0, len(ids), batch_size):
+            flushed += counter.flush(ids[i:i + batch_size])
+        self.stdout.write('Flushed {} views'.format(flushed))
@@ -0,0 +1,41 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Post, Profile, Category
+from blog.renditions import spec_names, generate, init_worker
+
+
+class Command(BaseCommand):
+    help = 'Generates the image renditions that are missing, in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='processes generating, 0 generates in this process')
+
+    def handle(self, *args, **options):
+        pending = {}
+        for model in (Post, Profile, Category):
+            names = spec_names(model)
+            if not names:
+                continue
+            for instance in model.objects.iterator():
+                for name in names:
+                    file = getattr(instance, name)
+                    # renditions of the same source, such as the default cover, are shared
+                    if file.name not in pending and not file.cachefile_backend._exists(file):
+                        pending[file.name] = file
+        if options['workers']:
+            with ProcessPoolExecutor(options['workers'], initializer=init_worker) as pool:
+                futures = [pool.submit(generate, file.cachefile_backend, file) for file in pending.values()]
+                wait(futures)
+            failed = sum(1 for future in futures if future.exception() is not None)
+        else:
+            failed = 0
+            for file in pending.values():
+                try:
+                    generate(file.cachefile_backend, file)
+                except OSError:
+                    failed += 1
+        self.stdout.write('Generated {} renditions, {} failed'.format(len(pending) - failed, failed))
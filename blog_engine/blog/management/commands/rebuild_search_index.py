@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.search import get_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of posts'
+
+    def handle(self, *args, **options):
+        get_index().rebuild()
+        self.stdout.write('Indexed {} posts'.format(Post.objects.count()))
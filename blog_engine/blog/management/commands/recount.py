@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.counters import recount_posts, recount_categories
+from blog.models import Post, Category
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored comment, like and post counters from the rows they count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        for model, recount in ((Post, recount_posts), (Category, recount_categories)):
+            ids = list(model.objects.order_by('id').values_list('id', flat=True))
+            for i in range(0, len(ids), batch_size):
+                with transaction.atomic():
+                    updated += recount(ids[i:i + batch_size])
+        self.stdout.write('Recounted {} rows'.format(updated))
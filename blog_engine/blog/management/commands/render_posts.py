@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.models import Post
+from blog.rendering import RENDERER_VERSION, render_body
+
+
+class Command(BaseCommand):
+    help = 'Renders the Markdown of posts rendered by an older renderer, or of all posts, in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='render every post, not only the stale ones')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='processes rendering, 0 renders in this process')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.order_by('id')
+        if not options['all']:
+            posts = posts.exclude(body_html_version=RENDERER_VERSION)
+        ids = list(posts.values_list('id', flat=True))
+        batch_size = options['batch_size']
+        pool = ProcessPoolExecutor(options['workers']) if options['workers'] else None
+        try:
+            for i in range(0, len(ids), batch_size):
+                batch = list(Post.objects.filter(id__in=ids[i:i + batch_size]).only('id', 'body'))
+                bodies = [post.body for post in batch]
+                rendered = pool.map(render_body, bodies, chunksize=16) if pool else map(render_body, bodies)
+                for post, html in zip(batch, rendered):
+                    post.body_html, post.body_html_version = html, RENDERER_VERSION
+                with transaction.atomic():
+                    Post.objects.bulk_update(batch, ['body_html', 'body_html_version'])
+        finally:
+            if pool:
+                pool.shutdown()
+        self.stdout.write('Rendered {} posts'.format(len(ids)))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Fills the stored excerpt and reading time of posts from the text of their rendered bodies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(ids), batch_size):
+            posts = list(Post.objects.filter(id__in=ids[i:i + batch_size])
+                         .only('id', 'body', 'body_html', 'body_html_version'))
+            for post in posts:
+                post.summarize()
+            with transaction.atomic():
+                Post.objects.bulk_update(posts, ['excerpt', 'reading_time', 'body_html', 'body_html_version'])
+        self.stdout.write('Summarized {} posts'.format(len(ids)))
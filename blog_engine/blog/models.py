@@ -1,18 +1,26 @@
+import html
+
 from django.contrib.auth.models import User
 from django.db import models
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.urls import reverse
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
 from imagekit.models import ImageSpecField
-from pilkit.processors import Adjust, ResizeToFill, ResizeToFit
+
+from .images import responsive
+from .processors import DraftResizeToFill
+from .rendering import RENDERER_VERSION, render_body
+from .storage import images
 
 
 class Profile(models.Model):
     full_name = models.CharField(max_length=100, db_index=True)
-    image = models.ImageField(upload_to='static/images/users',
+    image = models.ImageField(upload_to='static/images/users', storage=images,
                               default='static/images/users/default-user-image.jpg')
     image_cropped = ImageSpecField(source='image',
-                                   processors=[ResizeToFill(256, 256)],
+                                   processors=[DraftResizeToFill(256, 256)],
                                    format='JPEG',
                                    options={'quality': 90})
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -30,15 +38,42 @@ class Profile(models.Model):
                                    full_name=instance.username)
 
     @receiver(post_save, sender=User)
-    def save_user_profile(sender, instance, **kwargs):
-        instance.profile.save()
+    def save_user_profile(sender, instance, update_fields=None, **kwargs):
+        # logging in only updates last_login, nothing the profile shows
+        if update_fields != {'last_login'}:
+            instance.profile.save()
+
+
+responsive(Profile, 'image', widths=(64, 128, 256), aspect=(1, 1))
+
+# listings show this many words of a post
+EXCERPT_WORDS = 20
+
+WORDS_PER_MINUTE = 200
+
+
+def save_without_counters(instance, counters, kwargs):
+    # counters are only changed with F() updates (blog.signals, blog.pageviews), saving an
+    # instance loaded before one of them must not write the old value back;
+    # like Model.save(), deferred fields are left alone too
+    if not instance._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+        deferred = instance.get_deferred_fields()
+        kwargs['update_fields'] = [field.name for field in instance._meta.concrete_fields
+                                   if not field.primary_key and field.name not in counters
+                                   and field.attname not in deferred]
+
 
 class Category(models.Model):
     title = models.CharField(max_length=50)
     slug = models.SlugField()
-    cover = models.ImageField(upload_to='static/images/categories',
+    cover = models.ImageField(upload_to='static/images/categories', storage=images,
                               blank=True,
                               default='static/images/categories/default-category-image.jpg')
+    posts_count = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        save_without_counters(self, ('posts_count',), kwargs)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
@@ -47,6 +82,9 @@ class Category(models.Model):
         return reverse('category_posts', kwargs={'slug': self.slug})
 
 
+responsive(Category, 'cover', widths=(480, 960, 1900))
+
+
 class Tag(models.Model):
     title = models.CharField(max_length=50)
     slug = models.SlugField()
@@ -62,14 +100,14 @@ class Post(models.Model):
     title = models.CharField(max_length=200)
     body = models.TextField()
     cover = models.ImageField(blank=True,
-                              upload_to='static/images/posts',
+                              upload_to='static/images/posts', storage=images,
                               default='static/images/posts/default-post-image.jpg')
     cover_small = ImageSpecField(source='cover',
-                                 processors=[ResizeToFill(800, 534)],
+                                 processors=[DraftResizeToFill(800, 534)],
                                  format='JPEG',
                                  options={'quality': 90})
     cover_big = ImageSpecField(source='cover',
-                               processors=[ResizeToFill(1900, 1267)],
+                               processors=[DraftResizeToFill(1900, 1267)],
                                format='JPEG',
                                options={'quality': 90})
     slug = models.SlugField()
@@ -79,6 +117,45 @@ class Post(models.Model):
     author = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='posts')
     likes = models.ManyToManyField(Profile, related_name='likes', blank=True)
     views = models.IntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    excerpt = models.TextField(blank=True, editable=False)
+    reading_time = models.PositiveIntegerField(default=1, editable=False)
+    body_html = models.TextField(blank=True, editable=False)
+    body_html_version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['date', 'id'])]
+
+    def summarize(self):
+        """Sets excerpt and reading_time (in minutes) from the text of the body, without its Markdown."""
+        if self.body_html_version != RENDERER_VERSION:
+            self.render()
+        text = html.unescape(strip_tags(self.body_html))
+        self.excerpt = Truncator(text).words(EXCERPT_WORDS, truncate=' …')
+        self.reading_time = max(1, round(len(text.split()) / WORDS_PER_MINUTE))
+
+    def render(self):
+        """Sets body_html from the body, which is Markdown."""
+        self.body_html = render_body(self.body)
+        self.body_html_version = RENDERER_VERSION
+
+    def ensure_rendered(self):
+        """Renders body_html again, and stores it, if an older renderer made it."""
+        if self.body_html_version != RENDERER_VERSION:
+            self.render()
+            Post.objects.filter(id=self.id).update(body_html=self.body_html, body_html_version=RENDERER_VERSION)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if ('body' in update_fields) if update_fields is not None else ('body' not in self.get_deferred_fields()):
+            self.render()
+            self.summarize()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'excerpt', 'reading_time', 'body_html',
+                                                                'body_html_version'}
+        save_without_counters(self, ('views', 'comments_count', 'likes_count'), kwargs)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
@@ -87,10 +164,28 @@ class Post(models.Model):
         return reverse('post_details', kwargs={'slug': self.slug})
 
 
+responsive(Post, 'cover', widths=(480, 800, 1200, 1900), aspect=(3, 2))
+
+
 class PinnedPost(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
 
 
+class TrendingWindow(models.Model):
+    name = models.CharField(max_length=10, primary_key=True)
+    epoch = models.FloatField()
+
+
+class TrendingScore(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='trending_scores')
+    window = models.CharField(max_length=10)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = [('post', 'window')]
+        indexes = [models.Index(fields=['window', '-score'])]
+
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     text = models.TextField()
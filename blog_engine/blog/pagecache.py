@@ -0,0 +1,137 @@
+"""
+The cache of whole anonymous pages, invalidated by tag.
+
+Tag versions live in the default cache, which must be shared by every
+process, or a page invalidated in one worker stays cached in the others.
+"""
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+
+from .cache import bump_around_commit
+from .purge import get_purger
+
+
+def post_tags(posts):
+    """Tags of a page showing the posts: the posts themselves, their categories and authors."""
+    tags = set()
+    for post in posts:
+        tags.update(('post-{}'.format(post.id),
+                     'category-{}'.format(post.category_id),
+                     'author-{}'.format(post.author_id)))
+    return tags
+
+
+def tagged(response, tags, **meta):
+    """Marks a response as cacheable, depending on the tags; meta is handed back on a hit."""
+    response.cache_tags = set(tags)
+    response.cache_meta = meta
+    # the same tags as surrogate keys, in the headers of Fastly and Varnish and of Cloudflare
+    response['Surrogate-Key'] = ' '.join(sorted(response.cache_tags))
+    response['Cache-Tag'] = ','.join(sorted(response.cache_tags))
+    return response
+
+
+class PageCache:
+    """
+    Rendered pages for anonymous visitors, keyed by URL and tagged with what they show.
+
+    Tags name objects ('post-1', 'category-2', 'tag-3', 'author-4') or lists
+    of posts ('listing-index', 'pinned', 'category-2-posts', ...). Every tag
+    has a version in the cache and an entry remembers the versions it was
+    rendered with, so invalidating a tag is one write that purges every page
+    showing it. The receivers in blog.signals invalidate the tags a change
+    touches, and the same keys are purged from the HTTP cache in front.
+    """
+    key_prefix = 'blog:page:'
+    tag_prefix = 'blog:pagetag:'
+    hits_key = 'blog:page:hits'
+    misses_key = 'blog:page:misses'
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'BLOG_PAGE_CACHE_TTL', 600)
+
+    def key(self, request):
+        return self.key_prefix + hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+
+    def _count(self, key):
+        if not cache.add(key, 1, None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                pass
+
+    def versions(self, tags):
+        keys = {self.tag_prefix + tag: tag for tag in tags}
+        versions = cache.get_many(list(keys))
+        for key in keys:
+            if key not in versions:
+                cache.add(key, uuid.uuid4().hex, None)
+                # with the cache down, a version no entry was stored under
+                versions[key] = cache.get(key) or uuid.uuid4().hex
+        return {keys[key]: version for key, version in versions.items()}
+
+    def get(self, request):
+        entry = cache.get(self.key(request))
+        if entry is not None:
+            versions = cache.get_many([self.tag_prefix + tag for tag in entry['tags']])
+            if all(versions.get(self.tag_prefix + tag) == version for tag, version in entry['tags'].items()):
+                self._count(self.hits_key)
+                return entry
+        self._count(self.misses_key)
+        return None
+
+    def set(self, request, response):
+        entry = {'tags': self.versions(response.cache_tags), 'meta': response.cache_meta, 'response': response}
+        cache.set(self.key(request), entry, self.timeout)
+
+    def invalidate(self, *tags):
+        if not tags:
+            return
+        bump_around_commit(lambda: cache.set_many({self.tag_prefix + tag: uuid.uuid4().hex for tag in tags}, None))
+        # the edge would cache the old content again if it refetched before the commit
+        transaction.on_commit(lambda: get_purger().purge(tags))
+
+    def stats(self):
+        return {'hits': cache.get(self.hits_key, 0), 'misses': cache.get(self.misses_key, 0)}
+
+
+page_cache = PageCache()
+
+
+class PageCacheMixin:
+    """
+    Serves a view from the page cache to anonymous visitors.
+
+    The view opts a response in with tagged(). base.html shows who is logged
+    in, so logged in users always get a fresh page, and responses vary on
+    Cookie. page_cache_hit() runs on every hit, for work the page must not skip.
+    """
+
+    def page_cache_hit(self, request, meta):
+        pass
+
+    def _cacheable(self, request, response):
+        return response.status_code == 200 and hasattr(response, 'cache_tags') and not response.cookies \
+            and not request.META.get('CSRF_COOKIE_USED')
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated or page_cache.timeout <= 0:
+            response = super().dispatch(request, *args, **kwargs)
+        else:
+            entry = page_cache.get(request)
+            if entry is not None:
+                self.page_cache_hit(request, entry['meta'])
+                response = entry['response']
+            else:
+                response = super().dispatch(request, *args, **kwargs)
+                if self._cacheable(request, response):
+                    page_cache.set(request, response)
+        patch_vary_headers(response, ('Cookie',))
+        return response
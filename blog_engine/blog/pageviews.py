@@ -0,0 +1,150 @@
+"""
+Post views, buffered in the default cache and written in batches.
+
+The buffer is only seen by the flush_views command and by other workers
+with a cache shared by every process (see CACHES).
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, close_old_connections
+from django.db.models import F
+
+from .models import Post
+from .trending import trending
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """
+    Buffers post views in the cache and writes them to Post.views in batches.
+
+    Increments go to one cache key per post, so with a shared cache backend every
+    worker writes to the same buffer. Each process flushes the posts it has seen
+    from a background thread every BLOG_VIEWS_FLUSH_INTERVAL seconds; the
+    flush_views management command drains the buffer for all posts.
+    """
+    key_prefix = 'blog:views:'
+    flush_lock_key = 'blog:views-flush:lock'
+    lock_timeout = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def interval(self):
+        return getattr(settings, 'BLOG_VIEWS_FLUSH_INTERVAL', 10)
+
+    def key(self, post_id):
+        return '{}{}'.format(self.key_prefix, post_id)
+
+    def incr(self, post_id, n=1):
+        if not self._buffer(post_id, n):
+            return
+        if self.interval <= 0:
+            self.flush()
+        else:
+            self._start()
+
+    def pending(self, post_id):
+        return cache.get(self.key(post_id)) or 0
+
+    def flush(self, post_ids=None):
+        if post_ids is None:
+            with self._lock:
+                post_ids, self._dirty = self._dirty, set()
+        keys = {self.key(post_id): post_id for post_id in post_ids}
+        # two processes draining at once would both read a count and both write it
+        if not self._lock_flush():
+            with self._lock:
+                self._dirty.update(post_ids)
+            return 0
+        counts = {}
+        try:
+            for key, n in cache.get_many(list(keys)).items():
+                if n:
+                    try:
+                        cache.decr(key, n)
+                    except ValueError:
+                        continue
+                    counts[keys[key]] = n
+        finally:
+            cache.delete(self.flush_lock_key)
+        if not counts:
+            return 0
+
+        # one UPDATE per distinct increment instead of one per post
+        groups = defaultdict(list)
+        for post_id, n in counts.items():
+            groups[n].append(post_id)
+        try:
+            with transaction.atomic():
+                for n, ids in groups.items():
+                    Post.objects.filter(id__in=ids).update(views=F('views') + n)
+                trending.record(counts, 'view')
+        except Exception:
+            for post_id, n in counts.items():
+                self._buffer(post_id, n)
+            raise
+        return sum(counts.values())
+
+    def _lock_flush(self):
+        deadline = time.time() + self.lock_timeout
+        while not cache.add(self.flush_lock_key, 1, self.lock_timeout):
+            # a lock no process holds is a cache that is down
+            if cache.get(self.flush_lock_key) is None or time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _buffer(self, post_id, n):
+        """Adds the views to the buffer, or writes them right away when the cache cannot hold them."""
+        key = self.key(post_id)
+        if not cache.add(key, n, timeout=None):
+            try:
+                cache.incr(key, n)
+            except ValueError:
+                # the cache is down, or dropped the key since the add
+                Post.objects.filter(id=post_id).update(views=F('views') + n)
+                return False
+        with self._lock:
+            self._dirty.add(post_id)
+        return True
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='blog-view-counter', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush post views')
+
+    def stop(self):
+        self._stopped.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to flush post views')
+
+
+counter = ViewCounter()
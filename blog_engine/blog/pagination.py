@@ -0,0 +1,104 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(direction, obj):
+    data = json.dumps([direction, obj.date.isoformat(), obj.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, date, pk = json.loads(data.decode())
+        date = parse_datetime(date)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev') or date is None or not isinstance(pk, int):
+        raise InvalidCursor(token)
+    return direction, date, pk
+
+
+class KeysetPage:
+    def __init__(self, paginator, object_list, has_next, has_previous, number=None):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.number = number
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return encode_cursor('next', self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return encode_cursor('prev', self.object_list[0])
+
+
+class KeysetPaginator:
+    """
+    Pages newest first on (date, id) without COUNT(*) or OFFSET.
+
+    Each page is a single indexed range query for per_page + 1 rows, the extra
+    row telling whether there is another page in that direction. Pages are
+    addressed by opaque cursors; page numbers are still accepted for old links.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, cursor=None, number=None):
+        if cursor:
+            direction, date, pk = decode_cursor(cursor)
+            if direction == 'next':
+                rows = self._fetch(self.queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=pk)))
+                return KeysetPage(self, rows[:self.per_page], len(rows) > self.per_page, True)
+            rows = self._fetch(self.queryset.filter(Q(date__gt=date) | Q(date=date, id__gt=pk)), reverse=True)
+            return KeysetPage(self, rows[:self.per_page][::-1], True, len(rows) > self.per_page)
+        if number and number > 1:
+            return self._numbered_page(number)
+        rows = self._fetch(self.queryset)
+        return KeysetPage(self, rows[:self.per_page], len(rows) > self.per_page, False, 1)
+
+    def _fetch(self, queryset, reverse=False, offset=0):
+        ordering = ('date', 'id') if reverse else ('-date', '-id')
+        return list(queryset.order_by(*ordering)[offset:offset + self.per_page + 1])
+
+    def _numbered_page(self, number):
+        # compatibility with /<page>/ links, a single OFFSET scan and still no COUNT(*)
+        rows = self._fetch(self.queryset, offset=(number - 1) * self.per_page)
+        if rows:
+            return KeysetPage(self, rows[:self.per_page], len(rows) > self.per_page, True, number)
+        rows = self._fetch(self.queryset, reverse=True)
+        return KeysetPage(self, rows[:self.per_page][::-1], False, len(rows) > self.per_page)
+
+    @property
+    def count(self):
+        # approximate: cached for BLOG_PAGINATOR_COUNT_TTL seconds
+        query = str(self.queryset.order_by().values('id').query)
+        key = 'blog:count:' + hashlib.md5(query.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = self.queryset.order_by().count()
+            cache.set(key, count, getattr(settings, 'BLOG_PAGINATOR_COUNT_TTL', 300))
+        return count
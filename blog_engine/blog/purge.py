@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import threading
+import time
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class Purger:
+    """
+    Tells the HTTP cache in front of the site to drop responses by surrogate key.
+
+    Responses carry the keys of what they show in Surrogate-Key and Cache-Tag
+    headers (see blog.pagecache.tagged); PageCache.invalidate() purges the
+    same keys here once the transaction that changed them commits.
+    """
+
+    def purge(self, keys):
+        raise NotImplementedError
+
+
+class NullPurger(Purger):
+    def purge(self, keys):
+        pass
+
+
+class FilePurger(Purger):
+    """Appends each purge to BLOG_PURGE_LOG as a line of JSON, for a local stand-in of the edge cache."""
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path or settings.BLOG_PURGE_LOG
+
+    def purge(self, keys):
+        line = json.dumps({'time': time.time(), 'keys': sorted(keys)})
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+    def read(self):
+        """Returns the purged key lists, oldest first."""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line)['keys'] for line in f if line.strip()]
+
+
+class HttpPurger(Purger):
+    """
+    Sends a PURGE request with the keys in a Surrogate-Key header to BLOG_PURGE_URL.
+
+    A failed purge is logged and otherwise ignored: the response stays at the
+    edge until its TTL, which is the situation without a purger at all.
+    """
+
+    def __init__(self, url=None, timeout=2):
+        self._url = url
+        self.timeout = timeout
+
+    @property
+    def url(self):
+        return self._url or settings.BLOG_PURGE_URL
+
+    def purge(self, keys):
+        request = Request(self.url, method='PURGE', headers={'Surrogate-Key': ' '.join(sorted(keys))})
+        try:
+            urlopen(request, timeout=self.timeout).close()
+        except (URLError, OSError):
+            logger.exception('Failed to purge %s', ' '.join(sorted(keys)))
+
+
+_purgers = {}
+
+
+def get_purger():
+    """Returns the purger named by BLOG_PURGER, one instance per process."""
+    path = getattr(settings, 'BLOG_PURGER', 'blog.purge.FilePurger')
+    if path not in _purgers:
+        _purgers[path] = import_string(path)()
+    return _purgers[path]
@@ -0,0 +1,115 @@
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import close_caches
+from django.db import connections, transaction
+from imagekit.cachefiles.backends import BaseAsync, CacheFileState
+from imagekit.cachefiles.strategies import JustInTime
+from imagekit.models.fields.utils import ImageSpecFileDescriptor
+
+from .cache import content_version
+from .pagecache import page_cache
+
+logger = logging.getLogger(__name__)
+
+# shown until a rendition is generated, keyed by the model it belongs to
+PLACEHOLDERS = {
+    'post': 'static/images/posts/default-post-image.jpg',
+    'profile': 'static/images/users/default-user-image.jpg',
+    'category': 'static/images/categories/default-category-image.jpg',
+}
+
+# page cache tags of the objects, the pages showing them have placeholders until their renditions are made
+TAGS = {
+    'post': 'post-{}',
+    'profile': 'author-{}',
+    'category': 'category-{}',
+}
+
+# a rendition is scheduled again if a worker has not generated it in this many seconds
+GENERATING_TIMEOUT = 60
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_worker():
+    """Drops the cache clients and database connections a forked worker shares with its parent's sockets."""
+    close_caches()
+    connections.close_all()
+
+
+def get_pool():
+    """The pool of BLOG_RENDITION_WORKERS processes, one per process, or None to generate in this one."""
+    global _pool
+    workers = getattr(settings, 'BLOG_RENDITION_WORKERS', 2)
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(workers, initializer=init_worker)
+        return _pool
+
+
+def spec_names(model):
+    """Names of the imagekit specs of a model."""
+    return [name for name, attr in vars(model).items() if isinstance(attr, ImageSpecFileDescriptor)]
+
+
+def generate(backend, file, force=False):
+    """Generates a rendition unless it is in the storage already, run by the workers."""
+    # the state says generating since it was scheduled, the storage tells whether it is done
+    if force or not backend._exists(file):
+        file._generate()
+    backend.set_state(file, CacheFileState.EXISTS)
+    file.close()
+
+
+def _refresh_pages(file):
+    instance = getattr(file.generator.source, 'instance', None)
+    if instance is not None and instance._meta.model_name in TAGS:
+        page_cache.invalidate(TAGS[instance._meta.model_name].format(instance.pk))
+        content_version.bump()
+
+
+def _done(backend, file, future):
+    if future.exception() is not None:
+        logger.error('Failed to generate a rendition', exc_info=future.exception())
+    else:
+        # set here too, with a per-process cache the worker set it in a copy of its own
+        backend.set_state(file, CacheFileState.EXISTS)
+        _refresh_pages(file)
+
+
+class ProcessPoolBackend(BaseAsync):
+    """
+    Generates imagekit renditions in a process pool, never in the request asking for them.
+
+    A rendition is scheduled once the transaction that saved its source
+    commits and marked as generating meanwhile, so templates fall back to
+    the placeholder instead of scheduling it again on every request; the
+    pages showing it are invalidated once it is generated. With
+    BLOG_RENDITION_WORKERS = 0 it is generated in this process, still after
+    the commit.
+    """
+
+    def schedule_generation(self, file, force=False):
+        self.cache.set(self.get_key(file), CacheFileState.GENERATING, GENERATING_TIMEOUT)
+        transaction.on_commit(lambda: self._submit(file, force))
+
+    def _submit(self, file, force):
+        pool = get_pool()
+        if pool is None:
+            generate(self, file, force)
+            _refresh_pages(file)
+        else:
+            pool.submit(generate, self, file, force).add_done_callback(lambda future: _done(self, file, future))
+
+
+class Ahead(JustInTime):
+    """Asks for renditions as soon as their source is saved, as well as whenever one is found missing."""
+
+    def on_source_saved(self, file):
+        file.generate()
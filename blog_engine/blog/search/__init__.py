@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .base import SearchBackend, tokenize
+from .database import DatabaseIndex
+from .fts5 import Fts5Index, match_expression
+from .inverted import InvertedIndex
+
+_indexes = {}
+
+
+def get_index():
+    """
+    Returns the search backend named by BLOG_SEARCH_BACKEND, one instance per process.
+
+    Without the setting SQLite's FTS5 is used when the build has it and the
+    in-process InvertedIndex otherwise.
+    """
+    path = getattr(settings, 'BLOG_SEARCH_BACKEND', None)
+    if path not in _indexes:
+        if path:
+            index = import_string(path)()
+        else:
+            index = Fts5Index()
+            if not index.is_available():
+                index = InvertedIndex()
+        _indexes[path] = index
+    return _indexes[path]
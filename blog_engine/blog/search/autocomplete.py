@@ -0,0 +1,133 @@
+import heapq
+import re
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from transliterate import translit
+
+from ..cache import bump_around_commit
+from ..models import Post, Tag, Category
+from .base import tokenize
+from .inverted import CYRILLIC
+
+VERSION_KEY = 'blog:autocomplete:version'
+
+# a title is found by a prefix of any of its first MAX_WORDS words
+MAX_WORDS = 8
+MAX_KEY_LENGTH = 32
+
+# the best matches of prefixes up to this long are computed ahead
+SHORT_PREFIX = 2
+
+# longer prefixes look at no more than this many keys
+MAX_SCAN = 2000
+
+
+def keys(title):
+    words = tokenize(title)
+    for i in range(min(len(words), MAX_WORDS)):
+        key = ' '.join(words[i:])[:MAX_KEY_LENGTH]
+        yield key
+        if CYRILLIC.search(key):
+            yield re.sub(r'[^\w ]', '', translit(key, 'ru', reversed=True))
+
+
+class PrefixIndex:
+    """
+    Titles ranked by a score and looked up by prefix in a sorted array of keys.
+
+    Every title has a key for each word it is found by, starting at that word.
+    A prefix is a bisect into the keys; the top matches of short prefixes,
+    whose key ranges are the largest, are precomputed.
+    """
+
+    def __init__(self, entries, limit):
+        # entries are (title, rank, slug)
+        self.entries = entries
+        self.limit = limit
+        pairs = sorted((key, i) for i, entry in enumerate(entries) for key in keys(entry[0]))
+        self.keys = [key for key, i in pairs]
+        self.refs = array('I', (i for key, i in pairs))
+        self.top = {}
+        for length in range(1, SHORT_PREFIX + 1):
+            for prefix, group in groupby(range(len(self.keys)), key=lambda n: self.keys[n][:length]):
+                self.top[prefix] = self._best(self.refs[n] for n in group)
+
+    def _best(self, refs):
+        return heapq.nlargest(self.limit, set(refs), key=lambda i: (self.entries[i][1], -i))
+
+    def lookup(self, prefix):
+        if len(prefix) <= SHORT_PREFIX:
+            refs = self.top.get(prefix, [])
+        else:
+            start = bisect_left(self.keys, prefix)
+            end = start
+            while end < len(self.keys) and end - start < MAX_SCAN and self.keys[end].startswith(prefix):
+                end += 1
+            refs = self._best(self.refs[start:end])
+        return [self.entries[i] for i in refs]
+
+
+class AutocompleteIndex:
+    """
+    Suggestions for the search box from post, tag and category titles.
+
+    Posts are ranked by views, tags and categories by the views of their posts.
+    Only the BLOG_AUTOCOMPLETE_MAX_POSTS most viewed posts are kept, which
+    bounds memory on large blogs. The index is rebuilt after the signals in
+    blog.signals report a change, in every process through a version in the
+    cache, and every BLOG_AUTOCOMPLETE_TTL seconds to pick up new views.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built = 0
+        self.indexes = None
+
+    def invalidate(self):
+        bump_around_commit(lambda: cache.set(VERSION_KEY, uuid.uuid4().hex, None))
+
+    def _fresh(self, version):
+        ttl = getattr(settings, 'BLOG_AUTOCOMPLETE_TTL', 300)
+        return self.indexes is not None and version == self._version and time.time() - self._built < ttl
+
+    def _ensure(self):
+        version = cache.get(VERSION_KEY)
+        if self._fresh(version):
+            return
+        with self._lock:
+            if self._fresh(version):
+                return
+            limit = getattr(settings, 'BLOG_AUTOCOMPLETE_LIMIT', 5)
+            max_posts = getattr(settings, 'BLOG_AUTOCOMPLETE_MAX_POSTS', 50000)
+            posts = Post.objects.order_by('-views', '-id').values_list('title', 'views', 'slug')
+            tags = Tag.objects.annotate(rank=Coalesce(Sum('posts__views'), 0)).values_list('title', 'rank', 'slug')
+            categories = Category.objects.annotate(rank=Coalesce(Sum('posts__views'), 0)) \
+                .values_list('title', 'rank', 'slug')
+            self.indexes = {
+                'posts': PrefixIndex(list(posts[:max_posts]), limit),
+                'tags': PrefixIndex(list(tags), limit),
+                'categories': PrefixIndex(list(categories), limit),
+            }
+            self._version = version
+            self._built = time.time()
+
+    def suggest(self, query):
+        """Returns {'posts': [(title, rank, slug), ...], 'tags': [...], 'categories': [...]}."""
+        prefix = ' '.join(tokenize(query))[:MAX_KEY_LENGTH]
+        if not prefix:
+            return {'posts': [], 'tags': [], 'categories': []}
+        self._ensure()
+        return {name: index.lookup(prefix) for name, index in self.indexes.items()}
+
+
+autocomplete = AutocompleteIndex()
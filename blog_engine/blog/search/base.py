@@ -0,0 +1,88 @@
+import re
+
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from ..models import Post
+
+WORD = re.compile(r'(\w+)')
+
+
+def normalize(word):
+    return word.lower().replace('ё', 'е')
+
+
+def tokenize(text):
+    return [normalize(word) for word in WORD.findall(text)]
+
+
+def _matcher(query):
+    # like the FTS5 match expression, every word must match and the last one is a prefix
+    tokens = tokenize(query)
+    if not tokens:
+        return None
+    exact, prefix = set(tokens[:-1]), tokens[-1]
+    return lambda word: normalize(word) in exact or normalize(word).startswith(prefix)
+
+
+def _render(parts, matches, words_at=1):
+    # parts alternate between separators and words, words_at is the index parity of the words
+    return mark_safe(''.join('<mark>{}</mark>'.format(escape(part)) if i % 2 == words_at and matches(part)
+                             else escape(part) for i, part in enumerate(parts)))
+
+
+def mark(text, query):
+    matches = _matcher(query)
+    if matches is None:
+        return escape(text)
+    return _render(WORD.split(text), matches)
+
+
+def snippet(text, query, words=24):
+    """Returns about `words` words of text around the first match, or None if nothing matches."""
+    matches = _matcher(query)
+    if matches is None:
+        return None
+    parts = WORD.split(text)
+    positions = range(1, len(parts), 2)
+    first = next((n for n, i in enumerate(positions) if matches(parts[i])), None)
+    if first is None:
+        return None
+    start = max(0, first - words // 4)
+    end = min(len(positions), start + words)
+    html = _render(parts[positions[start]:positions[end - 1] + 2], matches, words_at=0)
+    return mark_safe('{}{}{}'.format('… ' if start else '', html.rstrip(), ' …' if end < len(positions) else ''))
+
+
+class SearchBackend:
+    """
+    Full-text index of posts behind the Search view.
+
+    search() returns the ids of every matching post, best first, and the view
+    pages through them; highlight() is only asked about the ids on the page.
+    add() and remove() are called from the post_save and post_delete receivers
+    in blog.signals, create() after migrate.
+    """
+
+    def is_available(self):
+        return True
+
+    def create(self):
+        pass
+
+    def add(self, post):
+        raise NotImplementedError
+
+    def remove(self, post_id):
+        raise NotImplementedError
+
+    def rebuild(self):
+        raise NotImplementedError
+
+    def search(self, query):
+        raise NotImplementedError
+
+    def highlight(self, query, ids):
+        """Returns {post id: (title, snippet)} with the matched words wrapped in <mark>."""
+        return {pk: (mark(title, query), snippet(body, query))
+                for pk, title, body in Post.objects.filter(id__in=ids).values_list('id', 'title', 'body')}
@@ -0,0 +1,23 @@
+from django.db.models import Q
+
+from ..models import Post
+from .base import SearchBackend
+
+
+class DatabaseIndex(SearchBackend):
+    """No index at all: a LIKE scan over the posts table, newest first."""
+
+    def add(self, post):
+        pass
+
+    def remove(self, post_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query):
+        if not query.strip():
+            return []
+        return list(Post.objects.filter(Q(body__icontains=query) | Q(title__icontains=query))
+                    .order_by('-date').values_list('id', flat=True))
@@ -0,0 +1,136 @@
+"""
+Category and tag facets of search results as bitsets of post ids.
+
+The index is rebuilt when the version in the default cache changes, so it
+needs a cache shared by every process to see the other workers' posts.
+"""
+
+import threading
+import uuid
+from collections import defaultdict
+
+from django.core.cache import cache
+
+from ..cache import bump_around_commit
+from ..models import Post
+
+VERSION_KEY = 'blog:facets:version'
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def bitset(ids):
+    """The bits of the ids set, built in a bytearray: setting them on an int copies it for every id."""
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        data[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(data, 'little')
+
+
+def members(bits, ids):
+    """The ids, in order, whose bits are set, testing them in the bytes of bits rather than shifting it."""
+    data = bits.to_bytes(bits.bit_length() // 8 + 1, 'little')
+    size = len(data)
+    return [pk for pk in ids if pk >> 3 < size and data[pk >> 3] >> (pk & 7) & 1]
+
+
+class FacetIndex:
+    """
+    Category and tag membership of every post as bitsets indexed by post id.
+
+    Counting the matches of a search in one category or tag is a single AND
+    and popcount, no queries. The bitsets are built with two queries and kept
+    up to date from the post and tag signals in blog.signals; other processes
+    see the version bump in the cache and rebuild on their next search.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._loaded = False
+        self.categories = {}
+        self.tags = {}
+        self.post_category = {}
+
+    def _ensure(self):
+        version = cache.get(VERSION_KEY)
+        if self._loaded and version == self._version:
+            return
+        with self._lock:
+            self.post_category = dict(Post.objects.values_list('id', 'category_id'))
+            categories, tags = defaultdict(list), defaultdict(list)
+            for pk, category_id in self.post_category.items():
+                categories[category_id].append(pk)
+            for pk, tag_id in Post.tags.through.objects.values_list('post_id', 'tag_id'):
+                tags[tag_id].append(pk)
+            self.categories = {pk: bitset(ids) for pk, ids in categories.items()}
+            self.tags = {pk: bitset(ids) for pk, ids in tags.items()}
+            self._version = version
+            self._loaded = True
+
+    def _bump(self):
+        def bump():
+            self._version = uuid.uuid4().hex
+            cache.set(VERSION_KEY, self._version, None)
+        bump_around_commit(bump)
+
+    def set_category(self, post_id, category_id):
+        self._ensure()
+        with self._lock:
+            old = self.post_category.get(post_id)
+            if old is not None:
+                self.categories[old] &= ~(1 << post_id)
+            if category_id is None:
+                self.post_category.pop(post_id, None)
+            else:
+                self.post_category[post_id] = category_id
+                self.categories[category_id] = self.categories.get(category_id, 0) | 1 << post_id
+            self._bump()
+
+    def set_tags(self, post_ids, tag_ids, added):
+        self._ensure()
+        with self._lock:
+            bits = bitset(post_ids)
+            for tag_id in tag_ids:
+                if added:
+                    self.tags[tag_id] = self.tags.get(tag_id, 0) | bits
+                else:
+                    self.tags[tag_id] = self.tags.get(tag_id, 0) & ~bits
+            self._bump()
+
+    def remove_post(self, post_id):
+        self.set_category(post_id, None)
+        with self._lock:
+            tag_ids = [tag_id for tag_id, bits in self.tags.items() if bits >> post_id & 1]
+        self.set_tags([post_id], tag_ids, added=False)
+
+    def filter(self, ids, category=None, tags=()):
+        """Keeps the ids, in order, of posts in the category and all of the tags."""
+        self._ensure()
+        with self._lock:
+            bits = -1
+            if category is not None:
+                bits &= self.categories.get(category, 0)
+            for tag in tags:
+                bits &= self.tags.get(tag, 0)
+        if bits == -1:
+            return list(ids)
+        return members(bits, ids)
+
+    def counts(self, ids):
+        """Returns ({category id: matches}, {tag id: matches}) for the posts in ids, zero counts left out."""
+        self._ensure()
+        matches = bitset(ids)
+        with self._lock:
+            categories = {pk: popcount(bits & matches) for pk, bits in self.categories.items()}
+            tags = {pk: popcount(bits & matches) for pk, bits in self.tags.items()}
+        return ({pk: n for pk, n in categories.items() if n},
+                {pk: n for pk, n in tags.items() if n})
+
+
+facets = FacetIndex()
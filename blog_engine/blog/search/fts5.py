@@ -0,0 +1,83 @@
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from ..models import Post
+from .base import SearchBackend, tokenize
+
+TABLE = 'blog_post_fts'
+
+# bm25 column weights, a match in the title counts ten times one in the body
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+
+def match_expression(query):
+    # every word is quoted so user input can't use FTS5 syntax, the last one
+    # is a prefix so results show up while the word is still being typed
+    tokens = ['"{}"'.format(token) for token in tokenize(query)]
+    if tokens:
+        tokens[-1] += '*'
+    return ' '.join(tokens)
+
+
+def highlighted(text):
+    return mark_safe(escape(text).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+class Fts5Index(SearchBackend):
+    """Full-text index of post titles and bodies in an SQLite FTS5 table keyed by post id."""
+
+    def is_available(self):
+        if connection.vendor != 'sqlite':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            return ('ENABLE_FTS5',) in cursor.fetchall()
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5("
+                           "title, body, tokenize='unicode61 remove_diacritics 2')".format(TABLE))
+
+    def add(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(TABLE), [post.id])
+            cursor.execute('INSERT INTO {} (rowid, title, body) VALUES (%s, %s, %s)'.format(TABLE),
+                           [post.id, post.title, post.body])
+
+    def remove(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(TABLE), [post_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(TABLE))
+        self.create()
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO {} (rowid, title, body) SELECT id, title, body FROM {}'
+                           .format(TABLE, Post._meta.db_table))
+            cursor.execute("INSERT INTO {0} ({0}) VALUES ('optimize')".format(TABLE))
+
+    def search(self, query):
+        expression = match_expression(query)
+        if not expression:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, %s, %s)'.format(TABLE),
+                           [expression, TITLE_WEIGHT, BODY_WEIGHT])
+            return [row[0] for row in cursor.fetchall()]
+
+    def highlight(self, query, ids):
+        expression = match_expression(query)
+        if not expression or not ids:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid, highlight({0}, 0, %s, %s), snippet({0}, 1, %s, %s, %s, 24) '
+                           'FROM {0} WHERE {0} MATCH %s AND rowid IN ({1})'
+                           .format(TABLE, ', '.join(['%s'] * len(ids))),
+                           [_MARK_START, _MARK_END, _MARK_START, _MARK_END, '…', expression] + list(ids))
+            return {pk: (highlighted(title), highlighted(snippet)) for pk, title, snippet in cursor.fetchall()}
+
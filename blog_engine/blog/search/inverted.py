@@ -0,0 +1,360 @@
+import fcntl
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from transliterate import translit
+
+from ..models import Post
+from .base import SearchBackend, tokenize
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# a title word counts as this many body words, in term frequency and in document length
+TITLE_BOOST = 3
+
+# a prefix matches at most this many terms of the vocabulary
+MAX_EXPANSIONS = 64
+
+MAGIC = b'BLOGIDX1'
+HEADER = struct.Struct('<8s2s2xIII')
+
+# posts read at a time when the journal is replayed
+REPLAY_BATCH = 500
+
+CYRILLIC = re.compile('[а-я]')
+
+
+def index_terms(tokens):
+    # Cyrillic words are indexed in their transliterated form as well, the same
+    # one PostForm.clean_slug uses, so latin queries find Russian posts
+    for token in tokens:
+        yield token
+        if CYRILLIC.search(token):
+            yield re.sub(r'\W', '', translit(token, 'ru', reversed=True))
+
+
+def _words(data):
+    return memoryview(data).cast('B').cast('I')
+
+
+class InvertedIndex(SearchBackend):
+    """
+    In-process inverted index of post titles and bodies scored with BM25.
+
+    Each term has a posting list of document ids and term frequencies in two
+    array('I') sorted by id. The index is saved to BLOG_SEARCH_INDEX_PATH and
+    loaded with mmap: posting lists are read straight from the mapped file and
+    only copied into arrays when a post update touches them.
+
+    A post update is applied in this process and, once committed, the id of
+    the post is appended to a journal next to the file. Every process replays
+    the journal, reading the posts in it, before it searches or applies an
+    update, and the file is only written again when the journal grows past
+    BLOG_SEARCH_JOURNAL_SIZE bytes. The processes agree through flock() on a
+    lock file: the journal is appended to and the file replaced under an
+    exclusive lock, and read under a shared one.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._applied = 0
+        self._mmap = None
+        self._reset()
+
+    @property
+    def path(self):
+        return self._path or settings.BLOG_SEARCH_INDEX_PATH
+
+    @property
+    def journal_path(self):
+        return self.path + '.journal'
+
+    @contextmanager
+    def _locked(self, operation):
+        """Holds the thread lock and the lock file of the index, shared or exclusive."""
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path + '.lock', 'a') as f:
+                fcntl.flock(f, operation)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self.vocab = {}
+        self.terms = []
+        self.postings = []
+        self.doc_len = {}
+        self.doc_terms = {}
+        self.total_len = 0
+        self._sorted_terms = None
+
+    def _ensure(self):
+        with self._locked(fcntl.LOCK_SH):
+            if self._catch_up():
+                return
+        with self._locked(fcntl.LOCK_EX):
+            if not self._catch_up():
+                self._build()
+                self._write()
+
+    def _snapshot_id(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _catch_up(self):
+        """Loads the file if another process replaced it and replays the journal, False without a file."""
+        snapshot = self._snapshot_id()
+        if snapshot is None:
+            return False
+        if snapshot != self._snapshot:
+            if not self.load():
+                return False
+            self._snapshot, self._applied = snapshot, 0
+        self._replay()
+        return True
+
+    def _replay(self):
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._applied)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # a record is only complete with its newline
+        data = data[:data.rfind(b'\n') + 1]
+        if not data:
+            return
+        self._applied += len(data)
+        ids = sorted({int(line) for line in data.split()})
+        for i in range(0, len(ids), REPLAY_BATCH):
+            batch = ids[i:i + REPLAY_BATCH]
+            found = set()
+            for pk, title, body in Post.objects.filter(id__in=batch).values_list('id', 'title', 'body'):
+                self._add(pk, title, body)
+                found.add(pk)
+            for pk in set(batch) - found:
+                self._remove(pk)
+
+    def _build(self):
+        self._reset()
+        for pk, title, body in Post.objects.order_by('id').values_list('id', 'title', 'body').iterator():
+            self._add(pk, title, body)
+
+    def _mutable(self, tid):
+        docs, tfs = self.postings[tid]
+        if not isinstance(docs, array):
+            docs, tfs = array('I', docs), array('I', tfs)
+            self.postings[tid] = (docs, tfs)
+        return docs, tfs
+
+    def _add(self, doc_id, title, body):
+        self._remove(doc_id)
+        title, body = tokenize(title), tokenize(body)
+        tf = Counter()
+        for term in index_terms(title):
+            tf[term] += TITLE_BOOST
+        for term in index_terms(body):
+            tf[term] += 1
+        tids = array('I')
+        for term, n in tf.items():
+            tid = self.vocab.get(term)
+            if tid is None:
+                tid = self.vocab[term] = len(self.terms)
+                self.terms.append(term)
+                self.postings.append((array('I'), array('I')))
+                self._sorted_terms = None
+            docs, tfs = self._mutable(tid)
+            i = bisect_left(docs, doc_id)
+            docs.insert(i, doc_id)
+            tfs.insert(i, n)
+            tids.append(tid)
+        self.doc_terms[doc_id] = tids
+        self.doc_len[doc_id] = TITLE_BOOST * len(title) + len(body)
+        self.total_len += self.doc_len[doc_id]
+
+    def _remove(self, doc_id):
+        tids = self.doc_terms.pop(doc_id, None)
+        if tids is None:
+            return
+        for tid in tids:
+            docs, tfs = self._mutable(tid)
+            i = bisect_left(docs, doc_id)
+            if i < len(docs) and docs[i] == doc_id:
+                del docs[i]
+                del tfs[i]
+        self.total_len -= self.doc_len.pop(doc_id)
+
+    def add(self, post):
+        self._ensure()
+        with self._lock:
+            self._add(post.id, post.title, post.body)
+        self._log(post.id)
+
+    def remove(self, post_id):
+        self._ensure()
+        with self._lock:
+            self._remove(post_id)
+        self._log(post_id)
+
+    def _log(self, post_id):
+        # the other processes read the post, so they must not before it is committed
+        transaction.on_commit(lambda: self._append(post_id))
+
+    def _append(self, post_id):
+        with self._locked(fcntl.LOCK_EX):
+            with open(self.journal_path, 'ab') as f:
+                f.write('{}\n'.format(post_id).encode())
+                size = f.tell()
+            if size > getattr(settings, 'BLOG_SEARCH_JOURNAL_SIZE', 16384):
+                if not self._catch_up():
+                    self._build()
+                self._write()
+
+    def rebuild(self):
+        with self._locked(fcntl.LOCK_EX):
+            self._build()
+            self._write()
+
+    def _write(self):
+        """Saves the index, which has the whole journal applied, and empties the journal."""
+        self.save()
+        with open(self.journal_path, 'wb'):
+            pass
+        self._snapshot, self._applied = self._snapshot_id(), 0
+
+    def _expand(self, prefix):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.vocab)
+        i = bisect_left(self._sorted_terms, prefix)
+        terms = self._sorted_terms[i:i + MAX_EXPANSIONS]
+        return [self.vocab[term] for term in terms if term.startswith(prefix)]
+
+    def search(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        self._ensure()
+        with self._lock:
+            if not self.doc_len:
+                return []
+            n = len(self.doc_len)
+            avgdl = self.total_len / n or 1
+            scores = None
+            for i, token in enumerate(tokens):
+                if i == len(tokens) - 1:
+                    tids = self._expand(token)
+                else:
+                    tids = [self.vocab[token]] if token in self.vocab else []
+                token_scores = {}
+                for tid in tids:
+                    docs, tfs = self.postings[tid]
+                    if not len(docs):
+                        continue
+                    idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for doc, f in zip(docs, tfs):
+                        norm = K1 * (1 - B + B * self.doc_len[doc] / avgdl)
+                        score = idf * f * (K1 + 1) / (f + norm)
+                        if score > token_scores.get(doc, 0):
+                            token_scores[doc] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc: score + token_scores[doc] for doc, score in scores.items() if doc in token_scores}
+                if not scores:
+                    return []
+            return sorted(scores, key=lambda doc: (-scores[doc], -doc))
+
+    def save(self):
+        """
+        Writes the index to disk, replacing the old file atomically.
+
+        Layout after the header, all integers uint32 in native byte order:
+        vocabulary (terms joined by newlines, padded to 4 bytes), posting list
+        offsets (terms + 1), document ids, document lengths, document term list
+        offsets (docs + 1), document term ids, posting ids, posting frequencies.
+        """
+        vocab = '\n'.join(self.terms).encode()
+        vocab += b'\0' * (-len(vocab) % 4)
+        offsets, docs, tfs = array('I', [0]), array('I'), array('I')
+        for tid in range(len(self.terms)):
+            ids, freqs = self.postings[tid]
+            docs.extend(ids)
+            tfs.extend(freqs)
+            offsets.append(len(docs))
+        doc_ids = array('I', sorted(self.doc_len))
+        doc_lens = array('I', (self.doc_len[doc] for doc in doc_ids))
+        term_offsets, term_ids = array('I', [0]), array('I')
+        for doc in doc_ids:
+            term_ids.extend(self.doc_terms[doc])
+            term_offsets.append(len(term_ids))
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, sys.byteorder[:2].encode(), len(self.terms), len(doc_ids), len(vocab)))
+            f.write(vocab)
+            for data in (offsets, doc_ids, doc_lens, term_offsets, term_ids, docs, tfs):
+                data.tofile(f)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        magic, byteorder, n_terms, n_docs, vocab_len = HEADER.unpack_from(data)
+        if magic != MAGIC or byteorder != sys.byteorder[:2].encode():
+            data.close()
+            return False
+
+        def read(position, count):
+            return _words(data[position:position + count * 4]), position + count * 4
+
+        position = HEADER.size
+        terms = data[position:position + vocab_len].rstrip(b'\0').decode().split('\n') if n_terms else []
+        position += vocab_len
+        offsets, position = read(position, n_terms + 1)
+        doc_ids, position = read(position, n_docs)
+        doc_lens, position = read(position, n_docs)
+        term_offsets, position = read(position, n_docs + 1)
+        term_ids, position = read(position, term_offsets[-1])
+        postings_start = position
+        total = offsets[-1]
+
+        self._reset()
+        self.terms = terms
+        self.vocab = {term: tid for tid, term in enumerate(terms)}
+        view = memoryview(data)
+        docs = view[postings_start:postings_start + total * 4].cast('I')
+        tfs = view[postings_start + total * 4:postings_start + total * 8].cast('I')
+        self.postings = [(docs[offsets[tid]:offsets[tid + 1]], tfs[offsets[tid]:offsets[tid + 1]])
+                         for tid in range(n_terms)]
+        for i, doc in enumerate(doc_ids):
+            self.doc_len[doc] = doc_lens[i]
+            self.doc_terms[doc] = term_ids[term_offsets[i]:term_offsets[i + 1]]
+        self.total_len = sum(self.doc_len.values())
+        self._mmap = data
+        return True
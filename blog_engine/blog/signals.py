@@ -0,0 +1,243 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, post_migrate, m2m_changed
+from django.dispatch import receiver
+
+from .cache import sidebar_version, content_version
+from .counters import recount_posts
+from .models import Post, Tag, Category, Comment, Reply, PinnedPost, Profile
+from .pagecache import page_cache
+from .search import get_index
+from .storage import images
+from .search.autocomplete import autocomplete
+from .search.facets import facets
+from .trending import trending
+
+
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    if sender.name == 'blog':
+        get_index().create()
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    get_index().add(instance)
+    facets.set_category(instance.id, instance.category_id)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    get_index().remove(instance.id)
+    facets.remove_post(instance.id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def refresh_autocomplete(sender, **kwargs):
+    autocomplete.invalidate()
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def index_post_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        pk_set = set(instance.posts.values_list('id', flat=True) if reverse else
+                     instance.tags.values_list('id', flat=True))
+    elif action not in ('post_add', 'post_remove'):
+        return
+    post_ids, tag_ids = (pk_set, [instance.id]) if reverse else ([instance.id], pk_set)
+    facets.set_tags(post_ids, tag_ids, added=action == 'post_add')
+    sidebar_version.bump()
+    page_cache.invalidate('sidebar')
+    page_cache.invalidate(*['post-{}'.format(pk) for pk in post_ids],
+                          *['tag-{}-posts'.format(pk) for pk in tag_ids])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def purge_post_pages(sender, instance, **kwargs):
+    page_cache.invalidate('post-{}'.format(instance.id), 'listing-index',
+                          'category-{}-posts'.format(instance.category_id),
+                          'author-{}-posts'.format(instance.author_id))
+
+
+@receiver(pre_delete, sender=Post)
+def purge_post_tag_pages(sender, instance, **kwargs):
+    # the tags are unlinked by the delete itself, without m2m_changed
+    page_cache.invalidate(*['tag-{}-posts'.format(pk) for pk in instance.tags.values_list('id', flat=True)])
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def purge_liked_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        pk_set = set(instance.likes.values_list('id', flat=True) if reverse else [instance.id])
+    elif action not in ('post_add', 'post_remove'):
+        return
+    post_ids = pk_set if reverse else [instance.id]
+    page_cache.invalidate(*['post-{}'.format(pk) for pk in post_ids])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def purge_commented_pages(sender, instance, **kwargs):
+    page_cache.invalidate('post-{}'.format(instance.post_id))
+
+
+@receiver(post_save, sender=Reply)
+@receiver(post_delete, sender=Reply)
+def purge_replied_pages(sender, instance, **kwargs):
+    post_ids = Comment.objects.filter(id=instance.comment_id).values_list('post_id', flat=True)
+    page_cache.invalidate(*['post-{}'.format(pk) for pk in post_ids])
+
+
+@receiver(post_save, sender=PinnedPost)
+@receiver(post_delete, sender=PinnedPost)
+def purge_pinned_pages(sender, **kwargs):
+    page_cache.invalidate('pinned')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def purge_category_pages(sender, instance, **kwargs):
+    page_cache.invalidate('category-{}'.format(instance.id))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def purge_tag_pages(sender, instance, **kwargs):
+    page_cache.invalidate('tag-{}'.format(instance.id))
+
+
+@receiver(post_save, sender=Profile)
+def purge_author_pages(sender, instance, **kwargs):
+    page_cache.invalidate('author-{}'.format(instance.id))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def refresh_sidebar(sender, **kwargs):
+    sidebar_version.bump()
+    page_cache.invalidate('sidebar')
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def trend_likes(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add':
+        trending.record({pk: 1 for pk in pk_set} if reverse else {instance.id: len(pk_set)}, 'like')
+
+
+@receiver(post_save, sender=Comment)
+def trend_comments(sender, instance, created, **kwargs):
+    if created:
+        trending.record({instance.post_id: 1}, 'comment')
+
+
+@receiver(post_save, sender=Reply)
+def trend_replies(sender, instance, created, **kwargs):
+    if created:
+        trending.record({instance.comment.post_id: 1}, 'comment')
+
+
+# whatever the pages show, validated by ConditionalGetMixin
+CONTENT_MODELS = {Post, Comment, Reply, Category, Tag, PinnedPost, Profile, Post.tags.through, Post.likes.through}
+
+
+@receiver(post_save)
+@receiver(post_delete)
+@receiver(m2m_changed)
+def refresh_content(sender, **kwargs):
+    if sender in CONTENT_MODELS:
+        content_version.bump()
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(id=instance.post_id).update(comments_count=F('comments_count') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    Post.objects.filter(id=instance.post_id, comments_count__gt=0).update(comments_count=F('comments_count') - 1)
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def count_likes(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add':
+        # pk_set only has the likes actually added
+        if reverse:
+            Post.objects.filter(id__in=pk_set).update(likes_count=F('likes_count') + 1)
+        else:
+            Post.objects.filter(id=instance.id).update(likes_count=F('likes_count') + len(pk_set))
+    elif action == 'pre_clear' and reverse:
+        instance._cleared_likes = list(instance.likes.values_list('id', flat=True))
+    elif action in ('post_remove', 'post_clear'):
+        # pk_set has whatever was asked to be removed, existing or not
+        if not reverse:
+            recount_posts([instance.id])
+        elif action == 'post_remove':
+            recount_posts(pk_set)
+        else:
+            recount_posts(getattr(instance, '_cleared_likes', []))
+
+
+@receiver(pre_save, sender=Post)
+def remember_category(sender, instance, **kwargs):
+    instance._old_category_id = None
+    if instance.pk:
+        instance._old_category_id = Post.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    old = getattr(instance, '_old_category_id', None)
+    if created:
+        Category.objects.filter(id=instance.category_id).update(posts_count=F('posts_count') + 1)
+    elif old is not None and old != instance.category_id:
+        Category.objects.filter(id=old, posts_count__gt=0).update(posts_count=F('posts_count') - 1)
+        Category.objects.filter(id=instance.category_id).update(posts_count=F('posts_count') + 1)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    Category.objects.filter(id=instance.category_id, posts_count__gt=0).update(posts_count=F('posts_count') - 1)
+
+
+# the image field of each model, files shared through blog.storage are released when the last row lets go
+IMAGE_FIELDS = {Post: 'cover', Category: 'cover', Profile: 'image'}
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=Profile)
+def remember_image(sender, instance, **kwargs):
+    field = IMAGE_FIELDS[sender]
+    instance._old_image = None
+    # only a new upload replaces the image, so the others save without a query
+    if instance.pk and not getattr(instance, field)._committed:
+        instance._old_image = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Profile)
+def release_replaced_image(sender, instance, **kwargs):
+    old = getattr(instance, '_old_image', None)
+    if old and old != getattr(instance, IMAGE_FIELDS[sender]).name:
+        transaction.on_commit(lambda: images.release(old))
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Profile)
+def release_image(sender, instance, **kwargs):
+    name = getattr(instance, IMAGE_FIELDS[sender]).name
+    transaction.on_commit(lambda: images.release(name))
@@ -0,0 +1,160 @@
+import gzip
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# files worth compressing, the others (images, woff fonts) are compressed already
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.eot', '.ttf', '.otf', '.json', '.txt', '.xml', '.html')
+
+# a sibling is only written if it is smaller than the file by this much
+MIN_SAVING = 0.05
+
+# words of the templates, scripts and code, any of them could be a class
+WORD = re.compile(r'[\w-]+')
+CLASS = re.compile(r'\.(-?[_a-zA-Z][\w-]*)')
+NOT = re.compile(r':not\([^)]*\)')
+COMMENT = re.compile(r'/\*(?!!).*?\*/', re.S)
+
+# at-rules holding rules, the others (@font-face, @keyframes...) are kept whole
+NESTING = ('@media', '@supports', '@document')
+
+
+# files scanned for words, tests are left out since they name classes that are not used
+SOURCES = ('.html', '.js', '.py')
+TESTS = re.compile(r'^tests?(_.*)?\.py$')
+
+
+def used_words(paths):
+    """Every word of the sources under the paths, a superset of the classes they use."""
+    words = set()
+    for path in paths:
+        for root, dirs, names in os.walk(path):
+            for name in names:
+                if name.endswith(SOURCES) and not TESTS.match(name):
+                    with open(os.path.join(root, name), encoding='utf-8', errors='ignore') as f:
+                        words.update(WORD.findall(f.read()))
+    return words
+
+
+def _blocks(css):
+    """(prelude, body) of the top level statements of a stylesheet, body is None for @charset and the like."""
+    start = i = 0
+    while i < len(css):
+        c = css[i]
+        if c in '"\'':
+            i = css.index(c, i + 1)
+        elif c == ';':
+            yield css[start:i].strip(), None
+            start = i + 1
+        elif c == '{':
+            depth, j = 1, i + 1
+            while depth:
+                if css[j] in '"\'':
+                    j = css.index(css[j], j + 1)
+                depth += {'{': 1, '}': -1}.get(css[j], 0)
+                j += 1
+            yield css[start:i].strip(), css[i + 1:j - 1]
+            start = i = j
+            continue
+        i += 1
+
+
+def _selector_used(selector, words):
+    return all(name in words for name in CLASS.findall(NOT.sub('', selector)))
+
+
+def strip_unused_css(css, words):
+    """The stylesheet without the rules whose selectors all have a class none of the words name."""
+    rules = []
+    for prelude, body in _blocks(COMMENT.sub('', css)):
+        if body is None:
+            rules.append(prelude + ';')
+        elif prelude.startswith(NESTING):
+            inner = strip_unused_css(body, words)
+            if inner:
+                rules.append('{}{{\n{}\n}}'.format(prelude, inner))
+        elif prelude.startswith('@'):
+            rules.append('{}{{{}}}'.format(prelude, body))
+        else:
+            selectors = [s.strip() for s in prelude.split(',') if _selector_used(s, words)]
+            if selectors:
+                rules.append('{}{{{}}}'.format(','.join(selectors), body))
+    return '\n'.join(rules)
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    """
+    Collects static files under names with the hash of their content, so
+    they can be cached forever, next to .gz and .br (with the brotli
+    package installed) siblings for the server to send as they are.
+
+    The rules of BLOG_STATIC_STRIP_CSS no class in the templates, scripts or
+    form widgets names are stripped before the files are hashed. A file missing
+    from the manifest is served under its own name rather than failing the
+    page, as it does when collectstatic has not been run, and a stylesheet
+    referring to a missing file keeps the reference as it is.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def url_converter(self, name, hashed_files, template=None):
+        converter = super().url_converter(name, hashed_files, template)
+
+        def convert(match):
+            try:
+                return converter(match)
+            except ValueError:
+                # a url() of a file that is not there is left as it is
+                return match.group(0)
+        return convert
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            self.strip_unused_css(paths)
+        hashed = {}
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed[name] = hashed_name
+            yield name, hashed_name, processed
+        if not dry_run:
+            for name in hashed.values():
+                if name.endswith(COMPRESSIBLE):
+                    self.compress(name)
+
+    def strip_unused_css(self, paths):
+        css_paths = [path for path in getattr(settings, 'BLOG_STATIC_STRIP_CSS', []) if path in paths]
+        if not css_paths:
+            return
+        words = used_words(getattr(settings, 'BLOG_STATIC_STRIP_CSS_CONTENT', []))
+        for path in css_paths:
+            with self.open(path) as f:
+                css = f.read().decode()
+            self.delete(path)
+            self._save(path, ContentFile(strip_unused_css(css, words).encode()))
+            # hashed from the stripped copy rather than from where it was found
+            paths[path] = (self, path)
+
+    def compress(self, name):
+        with self.open(name) as f:
+            content = f.read()
+        siblings = [('.gz', gzip.compress(content, 9, mtime=0))]
+        if brotli:
+            siblings.append(('.br', brotli.compress(content)))
+        for extension, compressed in siblings:
+            if len(compressed) < len(content) * (1 - MIN_SAVING):
+                if self.exists(name + extension):
+                    self.delete(name + extension)
+                self._save(name + extension, ContentFile(compressed))
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import models
+from imagekit.cachefiles.backends import get_default_cachefile_backend
+from imagekit.utils import sanitize_cache_key
+
+# <upload_to>/<first two characters of the digest>/<digest>.<extension>
+CONTENT_ADDRESSED = re.compile(r'(?:^|/)[0-9a-f]{2}/(?P<digest>[0-9a-f]{32})\.\w+$')
+
+
+def content_digest(name):
+    """The digest of the content of a file the storage named, or None for other names."""
+    match = CONTENT_ADDRESSED.search(name or '')
+    return match.group('digest') if match else None
+
+
+def hash_file(content):
+    sha = hashlib.sha256()
+    for chunk in content.chunks():
+        sha.update(chunk)
+    content.seek(0)
+    return sha.hexdigest()[:32]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Names uploads by the hash of their content, so the same image uploaded
+    again is stored once and shares the renditions of the first upload.
+
+    Files are shared between rows, they are removed by release() once no
+    row of a field using the storage refers to them.
+    """
+
+    def content_name(self, name, content):
+        """The name of an upload by its content, in the directory and with the extension of the name."""
+        directory, basename = os.path.split(name)
+        digest = hash_file(content)
+        return os.path.join(directory, digest[:2], digest + os.path.splitext(basename)[1].lower())
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        saved = super()._save(name, content)
+        if saved != name:
+            # another upload of the same image got there first
+            self.delete(saved)
+        return name
+
+    def fields(self):
+        """(model, field name) of every file field using this storage."""
+        return [(model, field.name) for model in apps.get_models() for field in model._meta.fields
+                if isinstance(field, models.FileField) and field.storage is self]
+
+    def references(self, name):
+        """Rows referring to a file."""
+        return sum(model._default_manager.filter(**{field: name}).count() for model, field in self.fields())
+
+    def release(self, name):
+        """
+        Removes a file the storage named once no row refers to it, and its
+        renditions unless a copy under another field's directory still has
+        them. Returns whether it was removed.
+        """
+        digest = content_digest(name)
+        if digest is None or self.references(name) or not self.exists(name):
+            return False
+        self.delete(name)
+        basename = os.path.join(digest[:2], os.path.basename(name))
+        if not any(self.exists(os.path.join(model._meta.get_field(field).upload_to, basename))
+                   for model, field in self.fields()):
+            remove_renditions(digest)
+        return True
+
+
+def remove_renditions(digest):
+    """Deletes the renditions of an image by the digest of its content, see blog.images.content_hash_namer."""
+    backend = get_default_cachefile_backend()
+    directory = os.path.join(settings.IMAGEKIT_CACHEFILE_DIR, digest[:2])
+    try:
+        names = default_storage.listdir(directory)[1]
+    except FileNotFoundError:
+        return
+    for basename in names:
+        if basename.startswith(digest + '-'):
+            name = os.path.join(directory, basename)
+            default_storage.delete(name)
+            # or the rendition would be taken for generated if the image is uploaded again
+            backend.cache.delete(sanitize_cache_key('%s%s-state' % (settings.IMAGEKIT_CACHE_PREFIX, name)))
+
+
+images = ContentAddressedStorage()
@@ -0,0 +1,44 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
+
+from blog.images import FORMATS, RESPONSIVE
+from blog.renditions import PLACEHOLDERS
+
+register = template.Library()
+
+
+@register.filter
+def rendition(file, kind):
+    """
+    URL of a rendition, or of the placeholder for the kind of object ('post',
+    'profile' or 'category') while the rendition is being generated.
+    """
+    return '/' + (file.url if file else PLACEHOLDERS[kind])
+
+
+@register.simple_tag
+def picture(obj, sizes='100vw', **attrs):
+    """
+    A <picture> of a post, profile or category with a srcset for every format
+    of its responsive renditions, best first, and a JPEG <img>. The other
+    attributes go to the <img>. A format is left out until all of its widths
+    are generated, and the placeholder is shown until the JPEGs are.
+    """
+    files = {}
+    for width, name, spec_name in RESPONSIVE[type(obj)][1]:
+        files.setdefault(name, []).append((getattr(obj, spec_name), width))
+    srcsets = {name: [(file.url, width) for file, width in group]
+               for name, group in files.items() if all(file for file, width in group)}
+    jpeg = srcsets.pop('jpeg', None)
+    if not jpeg:
+        return format_html('<img src="/{}"{}>', PLACEHOLDERS[obj._meta.model_name], flatatt(attrs))
+    sources = format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', (
+        (mime_type, _srcset(srcsets[name]), sizes) for name, image_format, mime_type, options in FORMATS
+        if srcsets.get(name)))
+    return format_html('<picture>{}<img src="/{}" srcset="{}" sizes="{}"{}></picture>',
+                       sources, jpeg[len(jpeg) // 2][0], _srcset(jpeg), sizes, flatatt(attrs))
+
+
+def _srcset(files):
+    return ', '.join('/{} {}w'.format(url, width) for url, width in files)
@@ -0,0 +1,46 @@
+"""
+The test runner, keeping the files the tests write out of the tree.
+
+Uploads, renditions, the search index and the purge log go to a temporary
+MEDIA_ROOT holding a copy of static/images, removed once the tests are done.
+The tests run in one process, on a local memory cache whatever CACHES says.
+"""
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .pageviews import counter
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class TestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.media_root = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(settings.BASE_DIR, 'static', 'images'),
+                        os.path.join(self.media_root, 'static', 'images'))
+        # renditions are generated in the process of the tests, the workers would not see the override
+        self.settings = override_settings(CACHES=CACHES, MEDIA_ROOT=self.media_root, BLOG_RENDITION_WORKERS=0,
+                                          BLOG_SEARCH_INDEX_PATH=os.path.join(self.media_root, 'search.idx'),
+                                          BLOG_PURGE_LOG=os.path.join(self.media_root, 'purge.log'))
+        self.settings.enable()
+
+    def teardown_databases(self, old_config, **kwargs):
+        # flushed while the test database is there, rather than at exit into the real one
+        counter.stop()
+        super().teardown_databases(old_config, **kwargs)
+
+    def teardown_test_environment(self, **kwargs):
+        self.settings.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -1,7 +1,49 @@
-from django.test import TestCase, Client
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+from time import sleep, time as now
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models.signals import m2m_changed
+from django.template import Context, Template
+from django.template.defaultfilters import filesizeformat
+from django.templatetags.static import static
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image, ImageCms
+from pilkit.processors import ResizeToFill
 
 from blog.models import *
+from blog.cache import TwoTierCache, content_version, sidebar_version, tiered_cache
+from blog.checks import check_shared_cache
+from blog.comments import load_comments
 from blog.forms import *
+from blog.pagecache import page_cache
+from blog.pageviews import counter
+from blog.search import Fts5Index, InvertedIndex, get_index, match_expression
+from blog.search.autocomplete import AutocompleteIndex
+from blog.search.base import snippet
+from blog.staticfiles import brotli, strip_unused_css
+from blog.storage import content_digest, images
+from blog.search.facets import FacetIndex, bitset, members
+from blog.pagination import KeysetPaginator, InvalidCursor, decode_cursor
+from blog.processors import DraftResizeToFill, DraftResizeToFit
+from blog.purge import FilePurger
+from blog.rendering import render_body
+from blog.templatetags.blog_images import rendition
+from blog.trending import trending
 
 
 class PostTests(TestCase):
@@ -475,3 +517,1457 @@ class FeedbackFormTests(TestCase):
         self.assertEquals(message.name, data['name'])
         self.assertEquals(message.email, data['email'])
         self.assertEquals(message.message, data['message'])
+
+
+@override_settings(BLOG_VIEWS_FLUSH_INTERVAL=60)
+class ViewCounterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Category', slug='category')
+        Post.objects.create(title='Post 1', slug='post-1', body='Some text.', author=user.profile, category=category)
+        Post.objects.create(title='Post 2', slug='post-2', body='Some text.', author=user.profile, category=category)
+
+    def tearDown(self):
+        counter.flush()
+
+    @override_settings(BLOG_PAGE_CACHE_TTL=0)
+    def test_views_are_buffered(self):
+        post = Post.objects.get(slug='post-1')
+        self.client.get(post.get_absolute_url())
+        response = self.client.get(post.get_absolute_url())
+        self.assertEquals(Post.objects.get(slug='post-1').views, 0)
+        self.assertEquals(counter.pending(post.id), 2)
+        self.assertEquals(response.context['post'].views, 2)
+
+    def test_flush(self):
+        post1 = Post.objects.get(slug='post-1')
+        post2 = Post.objects.get(slug='post-2')
+        counter.incr(post1.id, 3)
+        counter.incr(post2.id, 3)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEquals(counter.flush([post1.id, post2.id]), 6)
+        # the same increment for both posts, one UPDATE of their views and one of their trending scores
+        updates = [query['sql'].split()[1] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEquals(updates, ['"blog_post"', '"blog_trendingscore"'])
+        self.assertEquals(Post.objects.get(slug='post-1').views, 3)
+        self.assertEquals(Post.objects.get(slug='post-2').views, 3)
+        self.assertEquals(counter.pending(post1.id), 0)
+
+    def test_flush_command(self):
+        post = Post.objects.get(slug='post-1')
+        counter.incr(post.id)
+        # counted by another worker sharing the cache, this process never saw the post
+        cache.set(counter.key(post.id + 1), 2, None)
+        call_command('flush_views', stdout=open(os.devnull, 'w'))
+        self.assertEquals(Post.objects.get(slug='post-1').views, 1)
+        self.assertEquals(Post.objects.get(id=post.id + 1).views, 2)
+
+    @override_settings(BLOG_VIEWS_FLUSH_INTERVAL=0)
+    def test_write_through(self):
+        post = Post.objects.get(slug='post-1')
+        self.client.get(post.get_absolute_url())
+        self.assertEquals(Post.objects.get(slug='post-1').views, 1)
+
+    def test_one_process_drains(self):
+        post = Post.objects.get(slug='post-1')
+        counter.incr(post.id, 3)
+        # another process is flushing, it wrote the count it read
+        cache.add(counter.flush_lock_key, 1, 60)
+        counter.lock_timeout = 0
+        try:
+            self.assertEquals(counter.flush([post.id]), 0)
+        finally:
+            del counter.lock_timeout
+        self.assertEquals(counter.pending(post.id), 3)
+        cache.delete(counter.flush_lock_key)
+        self.assertEquals(counter.flush(), 3)
+        self.assertEquals(Post.objects.get(slug='post-1').views, 3)
+
+    @override_settings(BLOG_PAGE_CACHE_TTL=0, CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': '127.0.0.1:1'}})
+    def test_cache_down(self):
+        tiered_cache.clear_local()
+        post = Post.objects.get(slug='post-1')
+        self.assertEquals(self.client.get(post.get_absolute_url()).status_code, 200)
+        self.assertEquals(Post.objects.get(slug='post-1').views, 1)
+
+
+class QueryBudgetMixin:
+
+    def assertQueryBudget(self, budget, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        if len(queries) > budget:
+            self.fail('{} ran {} queries, budget is {}:\n{}'.format(
+                url, len(queries), budget, '\n'.join(q['sql'] for q in queries.captured_queries)))
+        return response
+
+
+class ListingQueryTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        users = [User.objects.create_user(username='user{}'.format(i), password='12345',
+                                          email='e{}@mail.com'.format(i)) for i in range(3)]
+        category = Category.objects.create(title='Category', slug='category')
+        tag = Tag.objects.create(title='Tag', slug='tag')
+        for i in range(10):
+            post = Post.objects.create(title='Post {}'.format(i),
+                                       slug='post-{}'.format(i),
+                                       body='Some text.',
+                                       author=users[i % 3].profile,
+                                       category=category)
+            post.tags.add(tag)
+            post.likes.add(*[user.profile for user in users[:i % 3 + 1]])
+            Comment.objects.create(post=post, text='Hi', author=users[0].profile)
+            if i < 3:
+                PinnedPost.objects.create(post=post)
+
+    def test_index(self):
+        response = self.assertQueryBudget(3, '/')
+        post = response.context['posts'].object_list[0]
+        self.assertEquals(post.comments_count, 1)
+        self.assertEquals(post.likes_count, post.likes.count())
+        self.assertEquals(len(response.context['pinned']), 3)
+
+    def test_tag_posts(self):
+        self.assertQueryBudget(3, '/tag/tag/2/')
+
+    def test_category_posts(self):
+        self.assertQueryBudget(3, '/category/category/')
+
+    def test_user_account(self):
+        response = self.assertQueryBudget(3, '/user/user0/')
+        self.assertEquals(response.context['count'], 4)
+
+
+@override_settings(BLOG_VIEWS_FLUSH_INTERVAL=0, BLOG_COMMENTS_PAGE_SIZE=5)
+class CommentThreadTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user1 = User.objects.create_user(username='user1', password='12345', email='e1@mail.com')
+        user2 = User.objects.create_user(username='user2', password='12345', email='e2@mail.com')
+        category = Category.objects.create(title='Category', slug='category')
+        post = Post.objects.create(title='Post title',
+                                   slug='post',
+                                   body='Some text.',
+                                   author=user1.profile,
+                                   category=category)
+        for i in range(12):
+            comment = Comment.objects.create(post=post, text='Comment {}'.format(i), author=user1.profile)
+            Reply.objects.create(comment=comment, text='Reply {}'.format(i), author=user2.profile)
+            Reply.objects.create(comment=comment, text='Reply {}'.format(i), author=user1.profile)
+
+    def test_queries(self):
+        post = Post.objects.get(slug='post')
+        with self.assertNumQueries(2):
+            thread = load_comments(post.id, limit=12)
+            replies = [reply for comment in thread.comments for reply in comment.thread_replies]
+            [item.author.get_absolute_url() for item in thread.comments + replies]
+        self.assertEquals(len(replies), 24)
+        self.assertIs(thread.comments[0].author, replies[1].author)
+
+    def test_pages(self):
+        post = Post.objects.get(slug='post')
+        thread = load_comments(post.id)
+        self.assertEquals([c.text for c in thread.comments], ['Comment {}'.format(i) for i in range(7, 12)])
+        thread = load_comments(post.id, before=thread.next_cursor)
+        self.assertEquals([c.text for c in thread.comments], ['Comment {}'.format(i) for i in range(2, 7)])
+        thread = load_comments(post.id, before=thread.next_cursor)
+        self.assertEquals([c.text for c in thread.comments], ['Comment 0', 'Comment 1'])
+        self.assertIsNone(thread.next_cursor)
+
+    def test_post_details(self):
+        response = self.client.get('/post/post/')
+        self.assertEquals(len(response.context['thread'].comments), 5)
+        self.assertContains(response, 'Load older comments')
+
+    def test_older_comments(self):
+        thread = load_comments(Post.objects.get(slug='post').id)
+        response = self.client.get('/json/post/post/comments/', {'before': thread.next_cursor})
+        data = response.json()
+        self.assertEquals(data['status'], 'OK')
+        self.assertIn('Comment 6', data['html'])
+        self.assertNotIn('Comment 7', data['html'])
+        self.assertIsNotNone(data['next'])
+
+
+class KeysetPaginatorTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Category', slug='category')
+        for i in range(7):
+            Post.objects.create(title='Post {}'.format(i), slug='post-{}'.format(i), body='Some text.',
+                                author=user.profile, category=category)
+        # equal dates are ordered by id
+        Post.objects.filter(slug__in=['post-2', 'post-3', 'post-4']).update(date=Post.objects.get(slug='post-2').date)
+
+    def titles(self, page):
+        return [post.title for post in page]
+
+    def test_pages(self):
+        paginator = KeysetPaginator(Post.objects.all(), 3)
+        with CaptureQueriesContext(connection) as queries:
+            page1 = paginator.page()
+            page2 = paginator.page(page1.next_cursor)
+            page3 = paginator.page(page2.next_cursor)
+        for query in queries.captured_queries:
+            self.assertNotIn('COUNT', query['sql'])
+            self.assertNotIn('OFFSET', query['sql'])
+        self.assertEquals(self.titles(page1), ['Post 6', 'Post 5', 'Post 4'])
+        self.assertEquals(self.titles(page2), ['Post 3', 'Post 2', 'Post 1'])
+        self.assertEquals(self.titles(page3), ['Post 0'])
+        self.assertFalse(page1.has_previous)
+        self.assertFalse(page3.has_next)
+        self.assertIsNone(page3.next_cursor)
+        self.assertEquals(self.titles(paginator.page(page3.previous_cursor)), self.titles(page2))
+        self.assertEquals(self.titles(paginator.page(page2.previous_cursor)), self.titles(page1))
+
+    def test_page_number(self):
+        paginator = KeysetPaginator(Post.objects.all(), 3)
+        page = paginator.page(number=2)
+        self.assertEquals(self.titles(page), ['Post 3', 'Post 2', 'Post 1'])
+        self.assertEquals(page.number, 2)
+        page = paginator.page(number=10)
+        self.assertEquals(self.titles(page), ['Post 2', 'Post 1', 'Post 0'])
+        self.assertFalse(page.has_next)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('garbage')
+        response = self.client.get('/', {'cursor': 'garbage'})
+        self.assertEquals(len(response.context['posts']), 7)
+
+    def test_count(self):
+        paginator = KeysetPaginator(Post.objects.all(), 3)
+        self.assertEquals(paginator.count, 7)
+        Post.objects.filter(slug='post-0').delete()
+        with self.assertNumQueries(0):
+            self.assertEquals(paginator.count, 7)
+
+    def test_listing_views(self):
+        post = Post.objects.first()
+        for i in range(7, 10):
+            Post.objects.create(title='Post {}'.format(i), slug='post-{}'.format(i), body='Some text.',
+                                author=post.author, category=post.category)
+        response = self.client.get('/category/category/')
+        page = response.context['posts']
+        self.assertContains(response, '?cursor={}'.format(page.next_cursor))
+        response = self.client.get('/category/category/', {'cursor': page.next_cursor})
+        self.assertEquals(self.titles(response.context['posts']), ['Post 1', 'Post 0'])
+        response = self.client.get('/category/category/2')
+        self.assertEquals(response.status_code, 200)
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Category', slug='category')
+        Post.objects.create(title='Cooking pasta', slug='pasta', body='Boil water and add <b>salt</b>.',
+                            author=user.profile, category=category)
+        Post.objects.create(title='Travel notes', slug='travel', body='We ate pasta in Rome.',
+                            author=user.profile, category=category)
+        Post.objects.create(title='Привет мир', slug='privet', body='Текст на русском языке.',
+                            author=user.profile, category=category)
+
+    def test_match_expression(self):
+        self.assertEquals(match_expression('pasta OR "salt'), '"pasta" "or" "salt"*')
+        self.assertEquals(match_expression('  '), '')
+
+    def test_ranking(self):
+        ids = Fts5Index().search('pasta')
+        self.assertEquals(ids, [Post.objects.get(slug='pasta').id, Post.objects.get(slug='travel').id])
+
+    def test_sync(self):
+        index = Fts5Index()
+        post = Post.objects.get(slug='travel')
+        post.body = 'We ate pizza in Rome.'
+        post.save()
+        self.assertEquals(index.search('pizza'), [post.id])
+        self.assertEquals(len(index.search('pasta')), 1)
+        post.delete()
+        self.assertEquals(index.search('pizza'), [])
+
+    def test_rebuild(self):
+        Post.objects.filter(slug='travel').update(title='Hiking')
+        call_command('rebuild_search_index', stdout=open(os.devnull, 'w'))
+        self.assertEquals(Fts5Index().search('hiking'), [Post.objects.get(slug='travel').id])
+
+    def test_cyrillic_prefix(self):
+        self.assertEquals(Fts5Index().search('русск'), [Post.objects.get(slug='privet').id])
+
+    def test_view(self):
+        response = self.client.get('/search/salt/')
+        posts = response.context['posts'].object_list
+        self.assertEquals([post.slug for post in posts], ['pasta'])
+        self.assertIn('<mark>salt</mark>', posts[0].snippet)
+        self.assertIn('&lt;b&gt;', posts[0].snippet)
+
+
+class InvertedIndexTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'search.idx')
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Category', slug='category')
+        Post.objects.create(title='Cooking pasta', slug='pasta', body='Boil water and add salt.',
+                            author=user.profile, category=category)
+        Post.objects.create(title='Travel notes', slug='travel', body='We ate pasta in Rome.',
+                            author=user.profile, category=category)
+        Post.objects.create(title='Привет мир', slug='privet', body='Объект на русском языке.',
+                            author=user.profile, category=category)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def ids(self, *slugs):
+        return [Post.objects.get(slug=slug).id for slug in slugs]
+
+    def test_search(self):
+        index = InvertedIndex(self.path)
+        self.assertEquals(index.search('pasta'), self.ids('pasta', 'travel'))
+        self.assertEquals(index.search('pasta rom'), self.ids('travel'))
+        self.assertEquals(index.search('pasta xyz'), [])
+        self.assertEquals(index.search(''), [])
+
+    def test_cyrillic(self):
+        index = InvertedIndex(self.path)
+        self.assertEquals(index.search('русском'), self.ids('privet'))
+        self.assertEquals(index.search('privet'), self.ids('privet'))
+        self.assertEquals(index.search('obekt'), self.ids('privet'))
+
+    def test_persistence(self):
+        InvertedIndex(self.path).search('pasta')
+        index = InvertedIndex(self.path)
+        self.assertTrue(index.load())
+        self.assertNotIsInstance(index.postings[index.vocab['pasta']][0], list)
+        ids = self.ids('pasta', 'travel')
+        with self.assertNumQueries(0):
+            self.assertEquals(index.search('pasta'), ids)
+
+    def test_updates(self):
+        index = InvertedIndex(self.path)
+        index.search('pasta')
+        post = Post.objects.get(slug='travel')
+        post.body = 'We ate pizza in Rome.'
+        index.add(post)
+        self.assertEquals(index.search('pasta'), self.ids('pasta'))
+        self.assertEquals(index.search('pizza'), [post.id])
+        index.remove(post.id)
+        self.assertEquals(index.search('pizza'), [])
+        # other processes only hear of it once the transaction commits
+        self.assertEquals(os.path.getsize(index.journal_path), 0)
+
+    def test_backend_setting(self):
+        with override_settings(BLOG_SEARCH_BACKEND='blog.search.InvertedIndex', BLOG_SEARCH_INDEX_PATH=self.path):
+            self.assertIsInstance(get_index(), InvertedIndex)
+            response = self.client.get('/search/pasta/')
+            self.assertEquals([post.slug for post in response.context['posts']], ['pasta', 'travel'])
+            self.assertIn('<mark>pasta</mark>', response.context['posts'][1].snippet)
+
+    def test_snippet(self):
+        text = ' '.join('word{}'.format(i) for i in range(100)) + ' <b>'
+        html = snippet(text, 'word50')
+        self.assertTrue(html.startswith('… word44'))
+        self.assertIn('<mark>word50</mark>', html)
+        self.assertIsNone(snippet(text, 'missing'))
+        self.assertTrue(snippet(text, 'word99').endswith('<mark>word99</mark> &lt;b&gt;'))
+
+
+@override_settings(BLOG_SEARCH_JOURNAL_SIZE=6)
+class InvertedIndexJournalTests(TransactionTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'search.idx')
+        self.addCleanup(shutil.rmtree, self.dir)
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        self.category = Category.objects.create(title='Category', slug='category')
+        self.author = user.profile
+        self.post = Post.objects.create(title='Cooking pasta', slug='pasta', body='Boil water.',
+                                        author=self.author, category=self.category)
+
+    def test_other_processes_replay_journal(self):
+        index, other = InvertedIndex(self.path), InvertedIndex(self.path)
+        self.assertEquals(other.search('pasta'), [self.post.id])
+        index_size = os.path.getsize(self.path)
+        self.post.body = 'Bake pizza.'
+        self.post.save()
+        index.add(self.post)
+        # appended to the journal, the index itself is not written again
+        self.assertEquals(os.path.getsize(self.path), index_size)
+        with open(index.journal_path) as f:
+            self.assertEquals(f.read(), '{}\n'.format(self.post.id))
+        self.assertEquals(other.search('pizza'), [self.post.id])
+        with self.assertNumQueries(0):
+            self.assertEquals(other.search('pizza'), [self.post.id])
+        post_id = self.post.id
+        self.post.delete()
+        other.remove(post_id)
+        self.assertEquals(index.search('pizza'), [])
+
+    def test_compacted(self):
+        index, other = InvertedIndex(self.path), InvertedIndex(self.path)
+        other.search('pasta')
+        index_size = os.path.getsize(self.path)
+        for i in range(5):
+            post = Post.objects.create(title='Soup {}'.format(i), slug='soup-{}'.format(i), body='Hot soup.',
+                                       author=self.author, category=self.category)
+            index.add(post)
+        # the journal went past 6 bytes and was written into the index
+        self.assertGreater(os.path.getsize(self.path), index_size)
+        self.assertLess(os.path.getsize(index.journal_path), 6)
+        self.assertEquals(len(other.search('soup')), 5)
+        self.assertEquals(len(InvertedIndex(self.path).search('soup')), 5)
+
+
+class FacetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        food = Category.objects.create(title='Food', slug='food')
+        travel = Category.objects.create(title='Travel', slug='travel')
+        italy = Tag.objects.create(title='Italy', slug='italy')
+        cheap = Tag.objects.create(title='Cheap', slug='cheap')
+        for i, (category, tags) in enumerate([(food, [italy]), (food, [italy, cheap]), (travel, [italy]),
+                                              (travel, [])]):
+            post = Post.objects.create(title='Pasta {}'.format(i), slug='pasta-{}'.format(i), body='Some text.',
+                                       author=user.profile, category=category)
+            post.tags.set(tags)
+
+    def ids(self, *slugs):
+        return [Post.objects.get(slug=slug).id for slug in slugs]
+
+    def test_counts(self):
+        index = FacetIndex()
+        ids = self.ids('pasta-0', 'pasta-1', 'pasta-2', 'pasta-3')
+        food, travel = Category.objects.get(slug='food').id, Category.objects.get(slug='travel').id
+        italy, cheap = Tag.objects.get(slug='italy').id, Tag.objects.get(slug='cheap').id
+        index._ensure()
+        with self.assertNumQueries(0):
+            self.assertEquals(index.counts(ids), ({food: 2, travel: 2}, {italy: 3, cheap: 1}))
+            self.assertEquals(index.counts(ids[2:]), ({travel: 2}, {italy: 1}))
+            self.assertEquals(index.filter(ids, category=food, tags=[italy]), ids[:2])
+            self.assertEquals(index.filter(ids, tags=[italy, cheap]), ids[1:2])
+
+    def test_bitsets(self):
+        ids = [999999, 3, 0, 8, 7, 500000, 64]
+        bits = bitset(ids)
+        self.assertEquals(bits, sum(1 << pk for pk in ids))
+        self.assertEquals(bitset([]), 0)
+        self.assertEquals(members(bits, [8, 9, 1000000, 5000000, 999999, 0]), [8, 999999, 0])
+        self.assertEquals(members(0, [0, 1]), [])
+
+    def test_incremental_updates(self):
+        index = FacetIndex()
+        index.counts([])
+        post = Post.objects.get(slug='pasta-3')
+        post.category = Category.objects.get(slug='food')
+        post.save()
+        post.tags.add(Tag.objects.get(slug='cheap'))
+        Tag.objects.get(slug='italy').posts.remove(Post.objects.get(slug='pasta-0'))
+        Post.objects.get(slug='pasta-1').delete()
+        expected = FacetIndex()
+        expected._ensure()
+        ids = self.ids('pasta-0', 'pasta-2', 'pasta-3')
+        self.assertEquals(index.counts(ids), expected.counts(ids))
+        self.assertEquals(index.counts(ids)[1], {Tag.objects.get(slug='italy').id: 1,
+                                                 Tag.objects.get(slug='cheap').id: 1})
+
+    def test_view(self):
+        response = self.client.get('/search/pasta/', {'category': 'food'})
+        self.assertEquals({post.slug for post in response.context['posts']}, {'pasta-0', 'pasta-1'})
+        self.assertEquals([(f['title'], f['count']) for f in response.context['tag_facets']],
+                          [('Italy', 2), ('Cheap', 1)])
+        self.assertTrue(response.context['category_facets'][0]['active'])
+        response = self.client.get('/search/pasta/', {'category': 'food', 'tag': ['italy', 'cheap']})
+        self.assertEquals([post.slug for post in response.context['posts']], ['pasta-1'])
+
+
+class AutocompleteTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        travel = Category.objects.create(title='Travel', slug='travel')
+        Tag.objects.create(title='Pasta', slug='pasta')
+        for i, (title, views) in enumerate([('Pasta with tomatoes', 5), ('Cheap pasta', 50),
+                                            ('Pastry in Paris', 10), ('Борщ по-киевски', 1)]):
+            Post.objects.create(title=title, slug='post-{}'.format(i), body='Some text.', views=views,
+                                author=user.profile, category=travel)
+
+    def test_prefix_ranked_by_views(self):
+        index = AutocompleteIndex()
+        titles = [title for title, views, slug in index.suggest('past')['posts']]
+        self.assertEquals(titles, ['Cheap pasta', 'Pastry in Paris', 'Pasta with tomatoes'])
+        self.assertEquals([title for title, views, slug in index.suggest('pa')['posts']], titles)
+        self.assertEquals([title for title, views, slug in index.suggest('pasta w')['posts']],
+                          ['Pasta with tomatoes'])
+        self.assertEquals([title for title, rank, slug in index.suggest('Pas')['tags']], ['Pasta'])
+        self.assertEquals(index.suggest('  ')['posts'], [])
+
+    def test_cyrillic_and_translit(self):
+        index = AutocompleteIndex()
+        self.assertEquals(index.suggest('кие')['posts'][0][0], 'Борщ по-киевски')
+        self.assertEquals(index.suggest('bors')['posts'][0][0], 'Борщ по-киевски')
+
+    def test_no_queries_once_built(self):
+        index = AutocompleteIndex()
+        index.suggest('pasta')
+        with self.assertNumQueries(0):
+            index.suggest('che')
+            index.suggest('t')
+
+    def test_signals_refresh(self):
+        index = AutocompleteIndex()
+        index.suggest('pasta')
+        Category.objects.create(title='Pastoral', slug='pastoral')
+        self.assertEquals([title for title, rank, slug in index.suggest('pasto')['categories']], ['Pastoral'])
+
+    def test_view(self):
+        response = self.client.get('/json/autocomplete/', {'q': 'chea'})
+        self.assertEquals(response.json()['data']['posts'], [{'title': 'Cheap pasta', 'url': '/post/post-1/'}])
+        self.assertEquals(response.json()['data']['tags'], [])
+
+
+@override_settings(BLOG_VIEWS_FLUSH_INTERVAL=60)
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        self.food = Category.objects.create(title='Food', slug='food')
+        self.travel = Category.objects.create(title='Travel', slug='travel')
+        self.pasta = Post.objects.create(title='Pasta', slug='pasta', body='Some text.',
+                                         author=self.user.profile, category=self.food)
+        self.rome = Post.objects.create(title='Rome', slug='rome', body='Some text.',
+                                        author=self.user.profile, category=self.travel)
+
+    def tearDown(self):
+        counter.flush()
+
+    def assertCached(self, url, cached=True):
+        stats = page_cache.stats()
+        self.client.get(url)
+        hits = page_cache.stats()['hits'] - stats['hits']
+        self.assertEquals(hits, 1 if cached else 0, url)
+
+    def test_hits_and_misses(self):
+        response = self.client.get('/')
+        self.assertIn('Cookie', response['Vary'])
+        self.assertEquals(page_cache.stats(), {'hits': 0, 'misses': 1})
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertContains(response, 'Pasta')
+        self.assertEquals(page_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_purges_affected_pages(self):
+        for url in ('/', '/post/pasta/', '/post/rome/', '/category/food/', '/category/travel/'):
+            self.client.get(url)
+        Comment.objects.create(post=self.pasta, author=self.user.profile, text='Yummy')
+        self.assertCached('/post/pasta/', False)
+        self.assertCached('/', False)
+        self.assertCached('/category/food/', False)
+        self.assertCached('/post/rome/')
+        self.assertCached('/category/travel/')
+
+    def test_new_post_purges_its_listings(self):
+        for url in ('/category/food/', '/category/travel/', '/tag/italy/'):
+            self.client.get(url)
+        italy = Tag.objects.create(title='Italy', slug='italy')
+        self.client.get('/tag/italy/')
+        post = Post.objects.create(title='Pizza', slug='pizza', body='Some text.',
+                                   author=self.user.profile, category=self.food)
+        self.assertCached('/category/food/', False)
+        self.assertCached('/category/travel/')
+        self.assertCached('/tag/italy/')
+        post.tags.add(italy)
+        self.assertContains(self.client.get('/tag/italy/'), 'Pizza')
+
+    def test_authenticated_users_bypass(self):
+        self.client.get('/post/pasta/')
+        self.client.login(username='tom', password='12345')
+        response = self.client.get('/post/pasta/')
+        self.assertIn('Vary', response)
+        self.assertEquals(page_cache.stats()['hits'], 0)
+
+    def test_hit_counts_view(self):
+        self.client.get('/post/pasta/')
+        self.client.get('/post/pasta/')
+        self.assertEquals(page_cache.stats()['hits'], 1)
+        self.assertEquals(counter.pending(self.pasta.id), 2)
+
+
+class TwoTierCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        self.cache = TwoTierCache(max_size=2, local_ttl=60)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_local_then_shared(self):
+        self.assertEquals(self.cache.get_or_set('a', self.compute, 60), 1)
+        self.assertEquals(self.cache.get_or_set('a', self.compute, 60), 1)
+        self.cache.clear_local()
+        self.assertEquals(self.cache.get_or_set('a', self.compute, 60), 1)
+        self.assertEquals(self.cache.stats(), {'misses': 1, 'local_hits': 1, 'hits': 1, 'size': 1})
+
+    def test_lru_is_bounded(self):
+        for key in 'abc':
+            self.cache.get_or_set(key, self.compute, 60)
+        self.assertEquals(list(self.cache._local), ['b', 'c'])
+
+    def test_single_flight(self):
+        def slow():
+            sleep(0.2)
+            return self.compute()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_set('a', slow, 60)))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(results, [1] * 5)
+        self.assertEquals(self.calls, 1)
+        self.assertEquals(self.cache.stats()['coalesced'], 4)
+
+    def test_stale_while_another_process_recomputes(self):
+        cache.set('a', ('old', 1.0, now() + 1), 60)
+        cache.add(self.cache.lock_prefix + 'a', 1)
+        self.cache.beta = 1000
+        self.assertEquals(self.cache.get_or_set('a', self.compute, 60), 'old')
+        self.assertEquals(self.calls, 0)
+
+    def test_early_refresh(self):
+        cache.set('a', ('old', 1.0, now() + 1), 60)
+        self.cache.beta = 1000
+        self.assertEquals(self.cache.get_or_set('a', self.compute, 60), 1)
+        self.cache.beta = 0
+        self.assertEquals(self.cache.get_or_set('a', self.compute, 60), 1)
+
+    def test_sidebar_invalidation(self):
+        self.assertEquals(self.client.get('/json/tags/').json()['data'], [])
+        with self.assertNumQueries(0):
+            self.client.get('/json/tags/')
+        Tag.objects.create(title='Italy', slug='italy')
+        self.assertEquals([tag['title'] for tag in self.client.get('/json/tags/').json()['data']], ['italy'])
+
+    def test_stats_for_staff_only(self):
+        self.assertEquals(self.client.get('/json/cache-stats/').status_code, 403)
+        User.objects.create_user(username='tom', password='12345', email='e@mail.com', is_staff=True)
+        self.client.login(username='tom', password='12345')
+        response = self.client.get('/json/cache-stats/')
+        self.assertIn('tiered', response.json()['data'])
+
+
+class BootstrapTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Food', slug='food')
+        Tag.objects.create(title='Italy', slug='italy')
+        post = Post.objects.create(title='Pasta', slug='pasta', body='Some text.', author=user.profile,
+                                   category=category)
+        trending.record({post.id: 1}, 'view')
+
+    def test_shared_part(self):
+        response = self.client.get('/json/bootstrap/')
+        data = response.json()['data']
+        self.assertEquals(data['tags'], self.client.get('/json/tags/').json()['data'])
+        self.assertEquals(data['categories'], self.client.get('/json/categories/').json()['data'])
+        self.assertEquals(data['popular_posts'], self.client.get('/json/popular-posts/').json()['data'])
+        self.assertNotIn('user', response.json())
+        self.assertIn('public', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            self.client.get('/json/bootstrap/', {'user': 1})
+
+    def test_gzip(self):
+        response = self.client.get('/json/bootstrap/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        self.assertEquals(json.loads(gzip.decompress(response.content).decode())['data']['tags'][0]['title'],
+                          'italy')
+
+    def test_user_panel(self):
+        self.client.login(username='tom', password='12345')
+        response = self.client.get('/json/bootstrap/', {'user': 1})
+        self.assertIn('Sign out', response.json()['user'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEquals(response.json()['data']['categories'][0]['posts_count'], 1)
+
+    def test_refreshed_by_signals(self):
+        self.client.get('/json/bootstrap/')
+        Tag.objects.create(title='Cheap', slug='cheap')
+        self.assertEquals(len(self.client.get('/json/bootstrap/').json()['data']['tags']), 2)
+
+
+class SidebarTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        self.categories = [Category.objects.create(title='Category {}'.format(i), slug='category-{}'.format(i))
+                           for i in range(3)]
+        self.tags = [Tag.objects.create(title='Tag {}'.format(i), slug='tag-{}'.format(i)) for i in range(3)]
+        for i in range(8):
+            post = Post.objects.create(title='Post {}'.format(i), slug='post-{}'.format(i), body='Some text.',
+                                       author=user.profile, category=self.categories[i % 2])
+            post.tags.set(self.tags[:1] if i else self.tags[:2])
+
+    def test_one_query_each(self):
+        with self.assertNumQueries(1):
+            categories = self.client.get('/json/categories/').json()['data']
+        with self.assertNumQueries(1):
+            tags = self.client.get('/json/tags/').json()['data']
+        self.assertEquals([category['posts_count'] for category in categories], [4, 4, 0])
+        self.assertEquals([(tag['posts_count'], tag['weight']) for tag in tags], [(8, 5), (1, 1), (0, 1)])
+
+    def test_version_bumped_by_retagging(self):
+        self.client.get('/json/tags/')
+        Post.objects.get(slug='post-1').tags.add(self.tags[2])
+        self.assertEquals([tag['posts_count'] for tag in self.client.get('/json/tags/').json()['data']], [8, 1, 1])
+        Post.objects.get(slug='post-1').delete()
+        self.assertEquals([tag['posts_count'] for tag in self.client.get('/json/tags/').json()['data']], [7, 1, 0])
+
+
+class TrendingTests(TestCase):
+    day = 24 * 60 * 60
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        self.user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Food', slug='food')
+        self.old, self.new = [Post.objects.create(title=title, slug=title.lower(), body='Some text.',
+                                                  author=self.user.profile, category=category)
+                              for title in ('Old', 'New')]
+        self.now = now()
+        trending.record({self.old.id: 10}, 'view', now=self.now - 3 * self.day)
+        trending.record({self.new.id: 2}, 'view', now=self.now)
+
+    def scores(self, window):
+        return dict(TrendingScore.objects.filter(window=window).values_list('post__slug', 'score'))
+
+    def test_decay(self):
+        self.assertEquals(trending.top('day', 3), [self.new, self.old])
+        self.assertEquals(trending.top('week', 3), [self.old, self.new])
+        self.assertEquals(trending.top('all', 3), [self.old, self.new])
+
+    def test_decayed_left_out(self):
+        self.assertEquals(trending.top('day', 3, now=self.now + 5 * self.day), [self.new])
+        self.assertEquals(trending.top('week', 3, now=self.now + 5 * self.day), [self.old, self.new])
+        self.assertEquals(trending.top('day', 3, now=self.now + 10 * self.day), [])
+
+    def test_compact(self):
+        trending.compact(now=self.now)
+        scores = self.scores('day')
+        self.assertAlmostEquals(scores['new'], 2)
+        self.assertAlmostEquals(scores['old'], 10 * math.exp(-3))
+        self.assertEquals(trending.compact(['day'], now=self.now + 5 * self.day), 1)
+        self.assertEquals(list(self.scores('day')), ['new'])
+        self.assertEquals(self.scores('all'), {'old': 10, 'new': 2})
+
+    def test_likes_and_comments(self):
+        self.old.likes.add(self.user.profile)
+        comment = Comment.objects.create(post=self.old, author=self.user.profile, text='Yummy')
+        Reply.objects.create(comment=comment, author=self.user.profile, text='Indeed')
+        self.assertEquals(self.scores('all')['old'], 10 + 5 + 10 + 10)
+
+    def test_view(self):
+        # the epoch of the window and the scores
+        with self.assertNumQueries(2):
+            data = self.client.get('/json/popular-posts/', {'window': 'day'}).json()['data']
+        self.assertEquals([post['title'] for post in data], ['New', 'Old'])
+        data = self.client.get('/json/popular-posts/', {'window': 'all'}).json()['data']
+        self.assertEquals([post['title'] for post in data], ['Old', 'New'])
+
+    def test_seed(self):
+        Post.objects.filter(id=self.new.id).update(views=50)
+        call_command('compact_trending', '--seed', stdout=open(os.devnull, 'w'))
+        self.assertEquals(self.scores('all'), {'old': 0, 'new': 50})
+
+
+@override_settings(BLOG_VIEWS_FLUSH_INTERVAL=60)
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        self.user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Food', slug='food')
+        self.post = Post.objects.create(title='Pasta', slug='pasta', body='Some text.', author=self.user.profile,
+                                        category=category)
+
+    def tearDown(self):
+        counter.flush()
+
+    def test_not_modified(self):
+        response = self.client.get('/')
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_writes_change_validators(self):
+        etag = self.client.get('/json/categories/')['ETag']
+        Comment.objects.create(post=self.post, author=self.user.profile, text='Yummy')
+        response = self.client.get('/json/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_users_get_their_own_validators(self):
+        etag = self.client.get('/').get('ETag')
+        self.client.login(username='tom', password='12345')
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_login_keeps_validators(self):
+        version = content_version.get()
+        self.client.post('/account/login/', {'username': 'tom', 'password': '12345', 'from_url': '/'})
+        self.assertIn('_auth_user_id', self.client.session)
+        self.assertEquals(content_version.get(), version)
+        self.user.profile.full_name = 'Tom'
+        self.user.save()
+        self.assertNotEquals(content_version.get(), version)
+        self.assertEquals(Profile.objects.get(id=self.user.profile.id).full_name, 'Tom')
+
+    # nothing listens there, as when memcached is down
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+                                           'LOCATION': '127.0.0.1:1'}})
+    def test_cache_down(self):
+        tiered_cache.clear_local()
+        version, modified = content_version.state()
+        self.assertNotEquals(content_version.get(), version)
+        for url in ('/', '/json/bootstrap/', '/search/pasta/'):
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_shared_json_does_not_vary_on_cookie(self):
+        response = self.client.get('/json/tags/')
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertEquals(self.client.get('/json/tags/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_not_modified_post_counts_view(self):
+        etag = self.client.get('/post/pasta/')['ETag']
+        response = self.client.get('/post/pasta/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(counter.pending(self.post.id), 2)
+
+
+class SurrogateKeyTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        self.dir = tempfile.mkdtemp()
+        # renditions purge their pages too, generated right away they do it before the tests start
+        self.settings = override_settings(BLOG_PURGER='blog.purge.FilePurger',
+                                          BLOG_PURGE_LOG=os.path.join(self.dir, 'purge.log'),
+                                          BLOG_RENDITION_WORKERS=0)
+        self.settings.enable()
+        self.user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        self.category = Category.objects.create(title='Food', slug='food')
+        self.post = Post.objects.create(title='Pasta', slug='pasta', body='Some text.', author=self.user.profile,
+                                        category=self.category)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+
+    def purged(self):
+        return [set(keys) for keys in FilePurger().read()]
+
+    def test_headers(self):
+        response = self.client.get('/')
+        keys = response['Surrogate-Key'].split()
+        self.assertIn('listing-index', keys)
+        self.assertIn('post-{}'.format(self.post.id), keys)
+        self.assertEquals(response['Cache-Tag'].split(','), keys)
+        self.assertIn('category-{}'.format(self.category.id), self.client.get('/post/pasta/')['Surrogate-Key'])
+
+    def test_sidebar_headers(self):
+        trending.record({self.post.id: 1}, 'view')
+        for url in ('/json/bootstrap/', '/json/popular-posts/'):
+            keys = self.client.get(url)['Surrogate-Key'].split()
+            self.assertIn('sidebar', keys)
+            self.assertIn('post-{}'.format(self.post.id), keys)
+        self.assertEquals(self.client.get('/json/autocomplete/', {'q': 'pas'})['Surrogate-Key'], 'sidebar')
+        open(FilePurger().path, 'w').close()
+        self.post.save()
+        self.assertTrue(any('sidebar' in keys for keys in self.purged()))
+
+    def test_purged_on_commit(self):
+        open(FilePurger().path, 'w').close()
+        Comment.objects.create(post=self.post, author=self.user.profile, text='Yummy')
+        self.assertIn({'post-{}'.format(self.post.id)}, self.purged())
+        Post.objects.create(title='Pizza', slug='pizza', body='Some text.', author=self.user.profile,
+                            category=self.category)
+        self.assertTrue(any({'listing-index', 'category-{}-posts'.format(self.category.id)} <= keys
+                            for keys in self.purged()))
+
+    def test_search_headers(self):
+        tag = Tag.objects.create(title='italy', slug='italy')
+        self.post.tags.add(tag)
+        keys = self.client.get('/search/pasta/', {'tag': 'italy'})['Surrogate-Key'].split()
+        for key in ('post-{}'.format(self.post.id), 'category-{}'.format(self.category.id),
+                    'tag-{}'.format(tag.id), 'listing-index'):
+            self.assertIn(key, keys)
+
+    def test_versions_bumped_on_commit(self):
+        with transaction.atomic():
+            self.post.tags.add(Tag.objects.create(title='italy', slug='italy'))
+            # what another process would store pages, ETags and indexes under before the commit
+            during = (page_cache.versions({'post-{}'.format(self.post.id)}), content_version.get(),
+                      sidebar_version.get(), cache.get('blog:autocomplete:version'), cache.get('blog:facets:version'))
+        after = (page_cache.versions({'post-{}'.format(self.post.id)}), content_version.get(),
+                 sidebar_version.get(), cache.get('blog:autocomplete:version'), cache.get('blog:facets:version'))
+        for version, committed in zip(during, after):
+            self.assertNotEquals(version, committed)
+
+    def test_not_purged_on_rollback(self):
+        open(FilePurger().path, 'w').close()
+        try:
+            with transaction.atomic():
+                Comment.objects.create(post=self.post, author=self.user.profile, text='Yummy')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEquals(self.purged(), [])
+
+
+class CounterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        self.user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        self.other = User.objects.create_user(username='ann', password='12345', email='a@mail.com')
+        self.food, self.drinks = [Category.objects.create(title=title, slug=title.lower())
+                                  for title in ('Food', 'Drinks')]
+        self.post = Post.objects.create(title='Pasta', slug='pasta', body='Some text.',
+                                        author=self.user.profile, category=self.food)
+
+    def counts(self):
+        post = Post.objects.get(id=self.post.id)
+        return post.comments_count, post.likes_count
+
+    def test_comments(self):
+        comment = Comment.objects.create(post=self.post, author=self.user.profile, text='Yummy')
+        Reply.objects.create(comment=comment, author=self.user.profile, text='Indeed')
+        self.assertEquals(self.counts(), (1, 0))
+        comment.delete()
+        self.assertEquals(self.counts(), (0, 0))
+
+    def test_likes(self):
+        self.post.likes.add(self.user.profile)
+        self.other.profile.likes.add(self.post)
+        self.assertEquals(self.counts(), (0, 2))
+        self.post.likes.remove(self.other.profile)
+        self.post.likes.remove(self.other.profile)
+        self.assertEquals(self.counts(), (0, 1))
+        self.user.profile.likes.clear()
+        self.assertEquals(self.counts(), (0, 0))
+
+    def test_stale_instance_keeps_counters(self):
+        post = Post.objects.get(id=self.post.id)
+        self.post.likes.add(self.user.profile)
+        Post.objects.filter(id=self.post.id).update(views=50)
+        post.title = 'Penne'
+        post.save()
+        self.assertEquals(self.counts(), (0, 1))
+        self.assertEquals(Post.objects.get(id=self.post.id).views, 50)
+
+    def test_category_posts(self):
+        pizza = Post.objects.create(title='Pizza', slug='pizza', body='Some text.',
+                                    author=self.user.profile, category=self.food)
+        self.assertEquals(Category.objects.get(id=self.food.id).posts_count, 2)
+        pizza.category = self.drinks
+        pizza.save()
+        self.assertEquals(list(Category.objects.order_by('id').values_list('posts_count', flat=True)), [1, 1])
+        pizza.delete()
+        self.assertEquals(list(Category.objects.order_by('id').values_list('posts_count', flat=True)), [1, 0])
+
+    def test_recount(self):
+        Comment.objects.create(post=self.post, author=self.user.profile, text='Yummy')
+        Post.objects.update(comments_count=7, likes_count=3)
+        Category.objects.update(posts_count=0)
+        call_command('recount', stdout=open(os.devnull, 'w'))
+        self.assertEquals(self.counts(), (1, 0))
+        self.assertEquals(Category.objects.get(id=self.food.id).posts_count, 1)
+
+
+class LikeToggleTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        self.user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Food', slug='food')
+        self.post = Post.objects.create(title='Pasta', slug='pasta', body='Some text.',
+                                        author=self.user.profile, category=category)
+        self.client.login(username='tom', password='12345')
+
+    def like(self, **data):
+        return self.client.post('/post/pasta/like/', data, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+    def test_toggle(self):
+        self.assertEquals(self.like(), {'status': 'OK', 'liked': True, 'count': 1})
+        self.assertEquals(self.like(), {'status': 'OK', 'liked': False, 'count': 0})
+        self.assertEquals(list(self.user.profile.likes.all()), [])
+
+    def test_idempotent(self):
+        self.assertEquals(self.like(liked='1')['count'], 1)
+        self.assertEquals(self.like(liked='1'), {'status': 'OK', 'liked': True, 'count': 1})
+        self.assertEquals(self.like(liked='0'), {'status': 'OK', 'liked': False, 'count': 0})
+        self.assertEquals(self.like(liked='0'), {'status': 'OK', 'liked': False, 'count': 0})
+        self.assertEquals(trending.top('all', 1), [self.post])
+
+    def test_signals(self):
+        sent = []
+
+        def record(sender, action, pk_set, **kwargs):
+            liked = Post.likes.through.objects.filter(post_id=self.post.id, profile_id=self.user.profile.id).exists()
+            sent.append((action, liked))
+        m2m_changed.connect(record, sender=Post.likes.through)
+        self.addCleanup(m2m_changed.disconnect, record, sender=Post.likes.through)
+        self.like(liked='1')
+        self.like(liked='0')
+        self.assertEquals(sent, [('pre_add', False), ('post_add', True), ('pre_remove', True), ('post_remove', False)])
+
+    def test_form_fallback(self):
+        response = self.client.post('/post/pasta/like/', {'liked': '1'})
+        self.assertRedirects(response, '/post/pasta/', fetch_redirect_response=False)
+        self.assertEquals(Post.objects.get(id=self.post.id).likes_count, 1)
+        self.assertEquals(self.client.post('/post/missing/like/').status_code, 404)
+
+
+class ExcerptTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Food', slug='food')
+        self.post = Post.objects.create(title='Pasta', slug='pasta', body=' '.join(['word'] * 500),
+                                        author=user.profile, category=category)
+
+    def test_summarized_on_save(self):
+        self.assertEquals(self.post.excerpt, ' '.join(['word'] * 20) + ' …')
+        self.assertEquals(self.post.reading_time, 2)
+        self.post.body = 'Short text.'
+        self.post.save(update_fields=['body'])
+        post = Post.objects.get(id=self.post.id)
+        self.assertEquals((post.excerpt, post.reading_time), ('Short text.', 1))
+
+    def test_markdown_left_out(self):
+        self.post.body = '# Pasta\n\nCook **al dente** & [serve](/post/sauce/) it.'
+        self.post.save()
+        self.assertEquals(Post.objects.get(id=self.post.id).excerpt, 'Pasta Cook al dente & serve it.')
+
+    def test_listing_defers_body(self):
+        PinnedPost.objects.create(post=self.post)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertContains(response, 'word word')
+        self.assertFalse(any('"blog_post"."body"' in query['sql'] for query in queries.captured_queries))
+
+    def test_backfill(self):
+        Post.objects.update(excerpt='', reading_time=1, body_html='', body_html_version=0)
+        call_command('summarize_posts', stdout=open(os.devnull, 'w'))
+        post = Post.objects.get(id=self.post.id)
+        self.assertEquals((post.excerpt, post.reading_time), (self.post.excerpt, 2))
+
+
+class RenderingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tiered_cache.clear_local()
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        category = Category.objects.create(title='Food', slug='food')
+        self.post = Post.objects.create(title='Pasta', slug='pasta',
+                                        body='Boil *water*.\n\n<script>alert(1)</script> [x](javascript:alert(1))',
+                                        author=user.profile, category=category)
+
+    def test_rendered_on_save(self):
+        self.assertEquals(self.post.body_html, '<p>Boil <em>water</em>.</p>\n'
+                                               '<p>&lt;script&gt;alert(1)&lt;/script&gt; <a href="#">x</a></p>')
+        self.assertContains(self.client.get('/post/pasta/'), '<em>water</em>')
+
+    def test_stale_rendered_lazily(self):
+        Post.objects.update(body_html='old', body_html_version=0)
+        self.assertContains(self.client.get('/post/pasta/'), '<em>water</em>')
+        self.assertEquals(Post.objects.get(id=self.post.id).body_html, self.post.body_html)
+
+    def test_command(self):
+        Post.objects.update(body_html='old', body_html_version=0)
+        call_command('render_posts', '--workers', '2', stdout=open(os.devnull, 'w'))
+        post = Post.objects.get(id=self.post.id)
+        self.assertEquals((post.body_html, post.body_html_version), (self.post.body_html, self.post.body_html_version))
+
+    def test_encoded_schemes(self):
+        for url in ['&#106;avascript:alert(1)', '&#x6A;avascript:alert(1)', '&#X6a;avascript:alert(1)',
+                    'java&#9;script:alert(1)', 'jav&Tab;ascript:alert(1)', 'javascript&#58;alert(1)',
+                    '&#0000106avascript:alert(1)', ' \x01JaVaScRiPt:alert(1)', 'data:text/html,x', 'vbscript:x']:
+            self.assertEquals(render_body('[x]({})'.format(url)), '<p><a href="#">x</a></p>', url)
+        self.assertEquals(render_body('![x](&#104;ttps://a.b/c.png)'), '<p><img alt="x" src="&#104;ttps://a.b/c.png" /></p>')
+        self.assertEquals(render_body('[x](/post/a/?a=1&amp;b=2)'), '<p><a href="/post/a/?a=1&amp;b=2">x</a></p>')
+
+
+@override_settings(IMAGEKIT_CACHEFILE_DIR='static/CACHE/tests', BLOG_RENDITION_WORKERS=0,
+                   BLOG_PURGER='blog.purge.NullPurger')
+class RenditionTests(TransactionTestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='tom', password='12345', email='e@mail.com')
+        # bulk_create sends no signals, nothing is generated ahead of the tests
+        Category.objects.bulk_create([Category(title='Food', slug='food')])
+        category = Category.objects.get(slug='food')
+        Post.objects.bulk_create([Post(title='Pasta', slug='pasta', body='Some text.', author=user.profile,
+                                       category=category)])
+        self.post = Post.objects.get(slug='pasta')
+        self.tearDown()
+        cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(default_storage.path('static/CACHE/tests'), ignore_errors=True)
+
+    def exists(self, file):
+        return file.storage.exists(file.name)
+
+    def test_generated_after_commit(self):
+        with transaction.atomic():
+            self.assertEquals(rendition(self.post.cover_small, 'post'), '/static/images/posts/default-post-image.jpg')
+            self.assertFalse(self.exists(self.post.cover_small))
+        self.assertTrue(self.exists(self.post.cover_small))
+        self.assertEquals(rendition(self.post.cover_small, 'post'), '/' + self.post.cover_small.url)
+
+    def test_generated_on_upload(self):
+        self.post.cover = 'static/images/img_1.jpg'
+        self.post.save()
+        self.assertTrue(self.exists(self.post.cover_small))
+        self.assertTrue(self.exists(self.post.cover_big))
+        # into the temporary MEDIA_ROOT of blog.testing.TestRunner, not the tree
+        self.assertFalse(self.post.cover_small.path.startswith(settings.BASE_DIR))
+
+    def test_command(self):
+        call_command('generate_renditions', '--workers', '2', stdout=open(os.devnull, 'w'))
+        for file in (self.post.cover_small, self.post.cover_big, self.post.cover_480_avif, self.post.cover_1900_jpeg,
+                     self.post.author.image_cropped, self.post.author.image_64_webp, self.post.category.cover_960_jpeg):
+            self.assertTrue(self.exists(file))
+
+    def test_content_hashed_names(self):
+        os.makedirs(default_storage.path('static/CACHE/tests'))
+        shutil.copy(default_storage.path('static/images/posts/default-post-image.jpg'),
+                    default_storage.path('static/CACHE/tests/copy.jpg'))
+        copy = Post(cover='static/CACHE/tests/copy.jpg')
+        self.assertEquals(copy.cover_800_webp.name, self.post.cover_800_webp.name)
+        self.assertNotEquals(Post(cover='static/images/img_1.jpg').cover_800_webp.name, self.post.cover_800_webp.name)
+        self.assertNotIn('default-post-image', self.post.cover_800_webp.name)
+        self.assertTrue(self.post.cover_800_webp.name.endswith('.webp'))
+
+    def picture(self, obj):
+        return Template('{% load blog_images %}{% picture obj sizes="50vw" alt="Cover" %}').render(Context({'obj': obj}))
+
+    def test_picture(self):
+        with transaction.atomic():
+            self.assertEquals(self.picture(self.post), '<img src="/static/images/posts/default-post-image.jpg" alt="Cover">')
+        call_command('generate_renditions', '--workers', '2', stdout=open(os.devnull, 'w'))
+        cache.clear()
+        html = self.picture(Post.objects.get(id=self.post.id))
+        self.assertTrue(html.startswith('<picture><source type="image/avif" srcset="/{} 480w, '.format(
+            self.post.cover_480_avif.url)))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('<img src="/{}" srcset="'.format(self.post.cover_1200_jpeg.url), html)
+        self.assertIn('1900w" sizes="50vw" alt="Cover"></picture>', html)
+
+
+class ProcessorTests(TestCase):
+
+    def jpeg(self, size, orientation=None):
+        f = tempfile.TemporaryFile()
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        Image.new('RGB', size, 'white').save(f, 'JPEG', exif=exif)
+        f.seek(0)
+        self.addCleanup(f.close)
+        return Image.open(f)
+
+    def test_same_sizes_as_pilkit(self):
+        for size in [(800, 534), (1900, 1267), (256, 256), (100, 300)]:
+            expected = ResizeToFill(*size).process(Image.open('static/images/img_1.jpg')).size
+            self.assertEquals(DraftResizeToFill(*size).process(Image.open('static/images/img_1.jpg')).size, expected)
+        self.assertEquals(DraftResizeToFit(480, upscale=False).process(Image.open('static/images/img_1.jpg')).size,
+                          (480, 320))
+        self.assertEquals(DraftResizeToFit(1900, upscale=False).process(Image.open('static/images/img_1.jpg')).size,
+                          (800, 534))
+
+    def test_draft(self):
+        img = self.jpeg((4000, 3000))
+        resized = DraftResizeToFill(256, 256).process(img)
+        self.assertEquals(resized.size, (256, 256))
+        # the decoder scaled it down by 8
+        self.assertEquals(img.size, (500, 375))
+
+    def test_orientation(self):
+        self.assertEquals(DraftResizeToFit(300).process(self.jpeg((1200, 800), orientation=6)).size, (300, 450))
+        self.assertEquals(DraftResizeToFill(300, 200).process(self.jpeg((1200, 800), orientation=8)).size, (300, 200))
+
+    def test_benchmark(self):
+        out = tempfile.TemporaryFile('w+')
+        call_command('benchmark_processors', 'static/images/img_1.jpg', '--runs', '1', stdout=out)
+        out.seek(0)
+        lines = out.read().splitlines()
+        self.assertEquals(lines[0], '1 images, 1 runs')
+        self.assertEquals(len(lines), 2 + 6)
+        self.assertTrue(lines[2].startswith('800x534     pilkit'))
+
+
+@override_settings(BLOG_IMAGE_MAX_SIZE=300)
+class UploadTests(TestCase):
+
+    def upload(self, size, image_format='JPEG', mode='RGB', **options):
+        f = io.BytesIO()
+        Image.new(mode, size, 'white').save(f, image_format, **options)
+        return SimpleUploadedFile('photo.' + image_format.lower(), f.getvalue(), 'image/' + image_format.lower())
+
+    def clean(self, upload):
+        field = RegisterForm.base_fields['image']
+        return field.clean(upload)
+
+    def test_scaled_down_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010f] = 'Camera'
+        file = self.clean(self.upload((1200, 800), exif=exif, comment=b'secret'))
+        image = Image.open(file)
+        self.assertEquals(image.format, 'JPEG')
+        self.assertEquals(image.size, (200, 300))
+        self.assertNotIn('exif', image.info)
+        self.assertNotIn('comment', image.info)
+        self.assertEquals(file.name, 'photo.jpg')
+        self.assertTrue(file.temporary_file_path())
+
+    def test_transparent_kept_as_png(self):
+        file = self.clean(self.upload((600, 600), 'PNG', 'RGBA'))
+        image = Image.open(file)
+        self.assertEquals((image.format, image.mode, image.size), ('PNG', 'RGBA', (300, 300)))
+        self.assertEquals(file.name, 'photo.png')
+
+    def test_colour_profile(self):
+        srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        self.assertEquals(Image.open(self.clean(self.upload((60, 40), icc_profile=srgb))).info['icc_profile'], srgb)
+        # the profile given with the CMYK pixels does not describe the RGB ones the image is saved with
+        image = Image.open(self.clean(self.upload((60, 40), mode='CMYK', icc_profile=srgb)))
+        self.assertEquals(image.mode, 'RGB')
+        self.assertNotIn('icc_profile', image.info)
+
+    def test_small_kept_size(self):
+        self.assertEquals(Image.open(self.clean(self.upload((100, 50), 'GIF', 'P'))).size, (100, 50))
+
+    @override_settings(BLOG_UPLOAD_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        form = PostForm(files={'cover': self.upload((40, 30))})
+        self.assertIn('megapixels', form.errors['cover'][0])
+        self.assertEquals(Image.open(self.clean(self.upload((40, 25)))).size, (40, 25))
+
+    def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            self.clean(SimpleUploadedFile('photo.jpg', b'not an image', 'image/jpeg'))
+
+    @override_settings(BLOG_UPLOAD_MAX_BYTES=1000)
+    def test_handler_cuts_off(self):
+        big, small = os.urandom(5000), b'x' * 500
+        request = RequestFactory().post('/', {'image': SimpleUploadedFile('big.jpg', big),
+                                              'cover': SimpleUploadedFile('small.jpg', small)})
+        self.assertEquals(request.FILES['cover'].read(), small)
+        self.assertFalse(request.FILES['cover'].too_large)
+        self.assertTrue(request.FILES['image'].too_large)
+        self.assertEquals(request.FILES['image'].read(), b'')
+        form = RegisterForm(files=request.FILES)
+        self.assertEquals(form.errors['image'], ['The image must be at most 1000\xa0bytes.'])
+
+    def test_category_form(self):
+        form = CategoryForm({'title': 'Travel', 'slug': 'travel'}, {'cover': self.upload((900, 600))})
+        self.assertTrue(form.is_valid())
+        self.assertEquals(Image.open(form.cleaned_data['cover']).size, (300, 200))
+
+
+@override_settings(BLOG_RENDITION_WORKERS=0, BLOG_PURGER='blog.purge.NullPurger')
+class StorageTests(TransactionTestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        shutil.copytree('static/images', os.path.join(root, 'static/images'))
+        media = override_settings(MEDIA_ROOT=root)
+        media.enable()
+        self.addCleanup(media.disable)
+        cache.clear()
+        self.author = User.objects.create_user(username='tom', password='12345', email='e@mail.com').profile
+        # bulk_create sends no signals, renditions are only generated where a test asks for them
+        Category.objects.bulk_create([Category(title='Food', slug='food')])
+        self.category = Category.objects.get(slug='food')
+
+    def jpeg(self, color='red'):
+        f = io.BytesIO()
+        Image.new('RGB', (120, 80), color).save(f, 'JPEG')
+        return SimpleUploadedFile('photo.jpg', f.getvalue())
+
+    def post(self, slug, cover=None):
+        Post.objects.bulk_create([Post(title=slug, slug=slug, body='Some text.', author=self.author,
+                                       category=self.category, cover=cover or self.jpeg())])
+        return Post.objects.get(slug=slug)
+
+    def renditions(self, name):
+        digest = os.path.basename(name)[:32]
+        return [name for name in images.listdir(os.path.join('static/CACHE', digest[:2]))[1] if name.startswith(digest)]
+
+    def test_same_content_stored_once(self):
+        first, second = self.post('pasta'), self.post('pizza')
+        self.assertEquals(first.cover.name, second.cover.name)
+        self.assertRegex(first.cover.name, r'^static/images/posts/[0-9a-f]{2}/[0-9a-f]{32}\.jpg$')
+        self.assertEquals(len(images.listdir(os.path.dirname(first.cover.name))[1]), 1)
+        self.assertNotEquals(self.post('soup', self.jpeg('blue')).cover.name, first.cover.name)
+        self.assertEquals(images.references(first.cover.name), 2)
+
+    def test_released_with_last_reference(self):
+        first, second = self.post('pasta'), self.post('pizza')
+        name = first.cover.name
+        first.cover_small.generate(force=True)
+        self.assertEquals(len(self.renditions(name)), 1)
+        first.delete()
+        self.assertTrue(images.exists(name))
+        second.delete()
+        self.assertFalse(images.exists(name))
+        self.assertEquals(self.renditions(name), [])
+
+    def test_released_when_replaced(self):
+        post = self.post('pasta')
+        name = post.cover.name
+        post.cover = self.jpeg('blue')
+        post.save(update_fields=['cover'])
+        self.assertFalse(images.exists(name))
+        self.assertTrue(images.exists(post.cover.name))
+
+    def test_default_kept(self):
+        self.author.user.delete()
+        self.category.delete()
+        self.assertTrue(images.exists('static/images/users/default-user-image.jpg'))
+        self.assertTrue(images.exists('static/images/categories/default-category-image.jpg'))
+
+    def test_dedupe_media(self):
+        content = self.jpeg().read()
+        for name in ('static/images/posts/a.jpg', 'static/images/posts/b.jpg'):
+            with open(images.path(name), 'wb') as f:
+                f.write(content)
+        Post.objects.bulk_create([Post(title=slug, slug=slug, body='Some text.', author=self.author,
+                                       category=self.category, cover='static/images/posts/{}.jpg'.format(name))
+                                  for slug, name in [('pasta', 'a'), ('pizza', 'b'), ('soup', 'b')]])
+        out = tempfile.TemporaryFile('w+')
+        call_command('dedupe_media', '--dry-run', stdout=out)
+        self.assertTrue(images.exists('static/images/posts/a.jpg'))
+        call_command('dedupe_media', stdout=out)
+        out.seek(0)
+        self.assertEquals(out.read().splitlines(), [
+            'Moved 2 images, 1 duplicates freeing {}, 0 missing (dry run)'.format(filesizeformat(len(content))),
+            'Moved 2 images, 1 duplicates freeing {}, 0 missing'.format(filesizeformat(len(content))),
+        ])
+        name, = set(Post.objects.values_list('cover', flat=True))
+        self.assertEquals(content_digest(name), hashlib.sha256(content).hexdigest()[:32])
+        self.assertFalse(images.exists('static/images/posts/a.jpg'))
+        self.assertFalse(images.exists('static/images/posts/b.jpg'))
+
+
+class StaticFilesTests(TestCase):
+
+    def test_strip_unused_css(self):
+        css = '''/*! License */
+@charset "UTF-8";
+/* a comment naming .unused */
+:root { --blue: #007bff; }
+.btn, .unused { color: red; }
+.btn:not(.disabled):hover, .unused > a { content: "}"; }
+@media (min-width: 576px) { .unused { margin: 0; } }
+@media print { .btn { display: none; } }
+@keyframes fade { from { opacity: 0; } to { opacity: 1; } }
+'''
+        self.assertEquals(strip_unused_css(css, {'btn', 'a'}), '\n'.join([
+            '/*! License */\n@charset "UTF-8";',
+            ':root{ --blue: #007bff; }',
+            '.btn{ color: red; }',
+            '.btn:not(.disabled):hover{ content: "}"; }',
+            '@media print{\n.btn{ display: none; }\n}',
+            '@keyframes fade{ from { opacity: 0; } to { opacity: 1; } }',
+        ]))
+
+    def test_collectstatic(self):
+        source, root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(source, 'css'))
+        shutil.copy('static/css/bootstrap.css', os.path.join(source, 'css'))
+        shutil.copytree('static/images/users', os.path.join(source, 'images'))
+        with open(os.path.join(source, 'css/site.css'), 'w') as f:
+            f.write('.a { background: url(../images/default-user-image.jpg); }\n'
+                    '.b { background: url(../images/missing.png); }\n' * 100)
+        with override_settings(STATICFILES_DIRS=[source], STATIC_ROOT=root,
+                               STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+                               BLOG_STATIC_STRIP_CSS_CONTENT=settings.BLOG_STATIC_STRIP_CSS_CONTENT):
+            call_command('collectstatic', '--noinput', stdout=open(os.devnull, 'w'))
+            url = static('css/bootstrap.css')
+            self.assertRegex(url, r'^/static/css/bootstrap\.[0-9a-f]{12}\.css$')
+            with open(os.path.join(root, url[len('/static/'):]), 'rb') as f:
+                content = f.read()
+            self.assertLess(len(content), os.path.getsize('static/css/bootstrap.css') / 2)
+            self.assertIn(b'.navbar-nav', content)
+            self.assertNotIn(b'.jumbotron', content)
+            # classes only the form widgets set
+            self.assertIn(b'.custom-select', content)
+            self.assertIn(b'.form-control-file', content)
+            with gzip.open(os.path.join(root, url[len('/static/'):] + '.gz')) as f:
+                self.assertEquals(f.read(), content)
+            if brotli:
+                with open(os.path.join(root, url[len('/static/'):] + '.br'), 'rb') as f:
+                    self.assertEquals(brotli.decompress(f.read()), content)
+            with open(os.path.join(root, static('css/site.css')[len('/static/'):])) as f:
+                site = f.read()
+            self.assertIn('url("../images/default-user-image.', site)
+            self.assertIn('url(../images/missing.png)', site)
+            # images are compressed already
+            self.assertFalse([name for name in os.listdir(os.path.join(root, 'images')) if name.endswith('.gz')])
+            self.assertEquals(static('css/not-collected.css'), '/static/css/not-collected.css')
+
+
+class SharedCacheCheckTests(TestCase):
+
+    def test_per_process_cache_warned(self):
+        self.assertEquals([error.id for error in check_shared_cache(None)], ['blog.W001'])
+        memcached = {'default': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+                                 'LOCATION': '127.0.0.1:11211'}}
+        with override_settings(CACHES=memcached):
+            self.assertEquals(check_shared_cache(None), [])
@@ -0,0 +1,115 @@
+import math
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Case, When, Value, FloatField
+
+from .models import Post, TrendingScore, TrendingWindow
+
+# time constants of the windows in seconds, scores in 'all' never decay
+WINDOWS = {
+    'day': 24 * 60 * 60,
+    'week': 7 * 24 * 60 * 60,
+    'month': 30 * 24 * 60 * 60,
+    'all': None,
+}
+
+# a window is compacted before its scale grows past e ** MAX_EXPONENT
+MAX_EXPONENT = 30
+
+
+class Trending:
+    """
+    Time-decayed popularity of posts, one row per post and window.
+
+    An event weighs exp(-age / tau). Instead of decaying every row as time
+    passes, an event at time t adds weight * exp((t - epoch) / tau), which
+    keeps rows in order of their decayed score; the index on (window, -score)
+    then gives the top posts of a window straight away. compact() moves the
+    epoch of each window to now, rescaling its rows and dropping those that
+    decayed below BLOG_TRENDING_MIN_SCORE, and runs by itself before the
+    scale gets too large for floats; top() leaves those rows out in between.
+    """
+
+    @property
+    def weights(self):
+        return getattr(settings, 'BLOG_TRENDING_WEIGHTS', {'view': 1, 'like': 5, 'comment': 10})
+
+    def _epochs(self, now):
+        epochs = dict(TrendingWindow.objects.values_list('name', 'epoch'))
+        missing = [TrendingWindow(name=name, epoch=now) for name in WINDOWS if name not in epochs]
+        if missing:
+            TrendingWindow.objects.bulk_create(missing, ignore_conflicts=True)
+            epochs = dict(TrendingWindow.objects.values_list('name', 'epoch'))
+        return epochs
+
+    def record(self, counts, event, now=None):
+        """Adds events of a kind, counts is {post id: number of events}."""
+        now = now or time.time()
+        weight = self.weights[event]
+        groups = defaultdict(list)
+        for post_id in Post.objects.filter(id__in=[pk for pk, n in counts.items() if n > 0]) \
+                .values_list('id', flat=True):
+            groups[counts[post_id]].append(post_id)
+        if not groups:
+            return
+        with transaction.atomic():
+            epochs = self._epochs(now)
+            TrendingScore.objects.bulk_create([TrendingScore(post_id=pk, window=window)
+                                               for ids in groups.values() for pk in ids for window in WINDOWS],
+                                              ignore_conflicts=True)
+            exponents = {window: 0 if tau is None else (now - epochs[window]) / tau for window, tau in WINDOWS.items()}
+            # one UPDATE per distinct count for all windows at once
+            for n, ids in groups.items():
+                TrendingScore.objects.filter(post_id__in=ids).update(score=F('score') + Case(
+                    *[When(window=window, then=Value(n * weight * math.exp(exponent)))
+                      for window, exponent in exponents.items()], output_field=FloatField()))
+            stale = [window for window, exponent in exponents.items() if exponent > MAX_EXPONENT]
+        if stale:
+            self.compact(stale, now)
+
+    def compact(self, windows=None, now=None):
+        """Moves the epochs of the windows to now and drops decayed rows, returns how many."""
+        now = now or time.time()
+        min_score = getattr(settings, 'BLOG_TRENDING_MIN_SCORE', 0.01)
+        dropped = 0
+        with transaction.atomic():
+            epochs = self._epochs(now)
+            for window in windows or WINDOWS:
+                tau = WINDOWS[window]
+                if tau is None:
+                    continue
+                scores = TrendingScore.objects.filter(window=window)
+                scores.update(score=F('score') * math.exp(-(now - epochs[window]) / tau))
+                dropped += scores.filter(score__lt=min_score).delete()[0]
+                TrendingWindow.objects.filter(name=window).update(epoch=now)
+        return dropped
+
+    def seed(self):
+        """Fills the all-time window from the views, likes and comments posts already have."""
+        weights = self.weights
+        posts = Post.objects.values_list('id', 'views', 'likes_count', 'comments_count')
+        with transaction.atomic():
+            TrendingScore.objects.filter(window='all').delete()
+            TrendingScore.objects.bulk_create(
+                TrendingScore(post_id=pk, window='all',
+                              score=weights['view'] * views + weights['like'] * likes + weights['comment'] * comments)
+                for pk, views, likes, comments in posts.iterator())
+
+    def top(self, window, n, now=None):
+        """The n posts trending most in the window, best first, leaving out those decayed below the minimum."""
+        scores = TrendingScore.objects.filter(window=window, score__gt=0)
+        tau = WINDOWS[window]
+        if tau is not None:
+            # the rows are scaled by the epoch of the window, the minimum too
+            epoch = TrendingWindow.objects.filter(name=window).values_list('epoch', flat=True).first()
+            if epoch is not None:
+                min_score = getattr(settings, 'BLOG_TRENDING_MIN_SCORE', 0.01)
+                scores = scores.filter(score__gte=min_score * math.exp(((now or time.time()) - epoch) / tau))
+        scores = scores.select_related('post').defer('post__body', 'post__body_html').order_by('-score')
+        return [score.post for score in scores[:n]]
+
+
+trending = Trending()
@@ -0,0 +1,122 @@
+import io
+import os
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageCms
+
+from .processors import DraftResizeToFit
+
+# modes saved as PNG to keep their transparency, the others are saved as JPEG
+TRANSPARENT = {'RGBA', 'LA', 'PA', 'P'}
+
+SRGB = ImageCms.createProfile('sRGB')
+
+
+def max_bytes():
+    return getattr(settings, 'BLOG_UPLOAD_MAX_BYTES', 20 * 1024 * 1024)
+
+
+class CappedUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams every upload to a temporary file chunk by chunk, never holding
+    it in memory. Once a file passes BLOG_UPLOAD_MAX_BYTES the rest of it
+    is dropped and the file is marked too_large for the form to reject.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.file.too_large = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > max_bytes():
+            if not self.file.too_large:
+                self.file.too_large = True
+                self.file.truncate(0)
+            return None
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+
+def to_srgb(image, icc_profile):
+    """The image as RGB, turned into sRGB with its colour profile when it has one that fits its mode."""
+    if icc_profile:
+        try:
+            return ImageCms.profileToProfile(image, ImageCms.ImageCmsProfile(io.BytesIO(icc_profile)), SRGB,
+                                             outputMode='RGB')
+        except (ImageCms.PyCMSError, ValueError, OSError):
+            pass
+    return image.convert('RGB')
+
+
+def ingest(image, name):
+    """
+    The image as it is stored: turned upright, scaled down to fit within
+    BLOG_IMAGE_MAX_SIZE and saved without its EXIF, XMP or comments,
+    keeping only the colour profile. Images of another mode than RGB saved
+    as JPEG are turned into sRGB and lose the profile of their old mode.
+    Written to a temporary file as well.
+    """
+    max_size = getattr(settings, 'BLOG_IMAGE_MAX_SIZE', 2560)
+    icc_profile = image.info.get('icc_profile')
+    image = DraftResizeToFit(max_size, max_size, upscale=False).process(image)
+    image.info = {}
+    if image.mode in TRANSPARENT:
+        image_format, extension, options = 'PNG', '.png', {'optimize': True}
+    else:
+        image_format, extension, options = 'JPEG', '.jpg', {'quality': 90, 'optimize': True}
+        if image.mode != 'RGB':
+            image, icc_profile = to_srgb(image, icc_profile), None
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    file = TemporaryUploadedFile(os.path.splitext(name)[0] + extension, Image.MIME[image_format], 0, None)
+    image.save(file, image_format, **options)
+    file.size = file.tell()
+    file.seek(0)
+    return file
+
+
+class UploadedImageField(forms.ImageField):
+    """
+    An image field rejecting uploads over BLOG_UPLOAD_MAX_BYTES, or over
+    BLOG_UPLOAD_MAX_PIXELS as the header tells, before the image is
+    decoded, and cleaning them into what ingest() stores.
+    """
+    default_error_messages = {
+        'too_large': 'The image must be at most %(size)s.',
+        'too_many_pixels': 'The image must be at most %(pixels)s megapixels, it is %(width)s x %(height)s.',
+    }
+
+    def to_python(self, data):
+        if not data:
+            return super().to_python(data)
+        if getattr(data, 'too_large', False) or (data.size or 0) > max_bytes():
+            raise ValidationError(self.error_messages['too_large'], code='too_large',
+                                  params={'size': filesizeformat(max_bytes())})
+        max_pixels = getattr(settings, 'BLOG_UPLOAD_MAX_PIXELS', 50000000)
+        try:
+            # only the header is read here
+            with Image.open(data) as image:
+                width, height = image.size
+        except Exception:
+            width = height = 0
+        if width * height > max_pixels:
+            raise ValidationError(self.error_messages['too_many_pixels'], code='too_many_pixels',
+                                  params={'pixels': max_pixels // 1000000, 'width': width, 'height': height})
+        data.seek(0)
+        file = super().to_python(data)
+        try:
+            with Image.open(file) as image:
+                return ingest(image, file.name)
+        except Exception as exc:
+            raise ValidationError(self.error_messages['invalid_image'], code='invalid_image') from exc
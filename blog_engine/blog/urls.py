@@ -40,6 +40,10 @@ urlpatterns = [
     path('json/tags/', TagsList.as_view(), name='tags_list'),
     path('json/categories/', CategoriesList.as_view(), name='categories_list'),
     path('json/popular-posts/', PopularPosts.as_view(), name='popular_posts'),
+    path('json/bootstrap/', Bootstrap.as_view(), name='bootstrap'),
+    path('json/cache-stats/', CacheStats.as_view(), name='cache_stats'),
+    path('json/autocomplete/', Autocomplete.as_view(), name='autocomplete'),
+    path('json/post/<slug>/comments/', PostComments.as_view(), name='post_comments'),
 
     path('partial/user-info/', UserInfo.as_view(), name='user_info'),
 
@@ -1,45 +1,186 @@
-import datetime
+import gzip
+import json
+import math
+import re
+import time
 
 from django.contrib import auth
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.core.exceptions import PermissionDenied
 from django.core.mail import send_mail, get_connection
 from django.core.paginator import Paginator, EmptyPage
-from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.views import View
 
-from blog.forms import RegisterForm, PostForm, CommentForm, UnlikeForm, LikeForm, CategoryForm, ReplyForm, \
-    FeedbackForm, TagForm, UpdateUserForm
+from blog.forms import RegisterForm, PostForm, CommentForm, CategoryForm, ReplyForm, FeedbackForm, TagForm, \
+    UpdateUserForm
 from blog_engine import settings
+from .cache import tiered_cache, sidebar_version
+from .comments import load_comments
+from .conditional import ConditionalGetMixin
+from .likes import set_like
 from .models import *
+from .pagecache import PageCacheMixin, tagged, post_tags, page_cache
+from .pagination import KeysetPaginator, KeysetPage, InvalidCursor
+from .pageviews import counter as view_counter
+from .renditions import PLACEHOLDERS
+from .search import get_index
+from .search.autocomplete import autocomplete
+from .search.facets import facets
+from .trending import trending, WINDOWS as TRENDING_WINDOWS
 
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
 
-class Index(View):
+
+# every post listing goes through here, so a page costs the same number of queries
+# however many posts it shows; comment and like counts are stored on the post,
+# and so is the excerpt shown instead of the body, which is never loaded
+def listing(posts):
+    return posts.select_related('author', 'category').defer('body', 'body_html')
+
+
+def paginate(request, posts, per_page, page=None):
+    paginator = KeysetPaginator(posts, per_page)
+    try:
+        return paginator.page(request.GET.get('cursor'), page)
+    except InvalidCursor:
+        return paginator.page()
+
+
+# pages of the public listings are shared by every visitor; the key carries the
+# versions of the page cache tags of the list, so adding or removing a post
+# starts a new key, and comment or like counts catch up within the timeout
+def cached_paginate(request, name, tags, posts, per_page, page=None):
+    def compute():
+        p = paginate(request, posts, per_page, page)
+        return list(p.object_list), p.has_next, p.has_previous, p.number
+
+    versions = page_cache.versions(tags)
+    key = 'blog:listing:{}:{}:{}:{}'.format(name, page, request.GET.get('cursor', ''),
+                                            ':'.join(versions[tag] for tag in sorted(tags)))
+    object_list, has_next, has_previous, number = tiered_cache.get_or_set(
+        key, compute, getattr(settings, 'BLOG_LISTING_CACHE_TTL', 60))
+    return KeysetPage(KeysetPaginator(posts, per_page), object_list, has_next, has_previous, number)
+
+
+def sidebar(name, compute):
+    key = 'blog:sidebar:{}:{}'.format(name, sidebar_version.get())
+    return tiered_cache.get_or_set(key, compute, getattr(settings, 'BLOG_SIDEBAR_CACHE_TTL', 300))
+
+
+# font weights of the tag cloud, from 1 for the least used tags to TAG_WEIGHTS, log scaled
+TAG_WEIGHTS = 5
+
+
+def tag_weights(counts):
+    used = [math.log(n) for n in counts if n]
+    low, high = (min(used), max(used)) if used else (0, 0)
+    return [1 + round((TAG_WEIGHTS - 1) * (math.log(n) - low) / (high - low)) if n and high > low else 1
+            for n in counts]
+
+
+def sidebar_tags():
+    def compute():
+        tags = list(Tag.objects.annotate(posts_count=Count('posts')).order_by('id'))
+        return [{'title': tag.title.lower(), 'url': tag.get_absolute_url(), 'posts_count': tag.posts_count,
+                 'weight': weight}
+                for tag, weight in zip(tags, tag_weights([tag.posts_count for tag in tags]))]
+
+    return sidebar('tags', compute)
+
+
+def sidebar_categories():
+    return sidebar('categories', lambda: [{'title': category.title,
+                                           'url': category.get_absolute_url(),
+                                           'posts_count': category.posts_count}
+                                          for category in Category.objects.order_by('id')])
+
+
+# the popular posts and the tags of the posts, for the responses showing them
+def sidebar_popular_posts(window='month'):
+    def compute():
+        posts = trending.top(window, 3)
+        return [{'title': post.title,
+                 'url': post.get_absolute_url(),
+                 'image': post.cover_small.url if post.cover_small else PLACEHOLDERS['post'],
+                 'date': post.date.date().strftime(" %b. %d, %Y")}
+                for post in posts], post_tags(posts)
+
+    return sidebar('popular-posts-' + window, compute)
+
+
+# the part of /json/bootstrap/ every visitor shares, serialized and gzipped once, with its tags
+def sidebar_bootstrap():
+    def compute():
+        popular_posts, tags = sidebar_popular_posts()
+        data = json.dumps({'tags': sidebar_tags(),
+                           'categories': sidebar_categories(),
+                           'popular_posts': popular_posts}, cls=DjangoJSONEncoder)
+        body = '{"status": "OK", "data": ' + data + '}'
+        return data, body.encode(), gzip.compress(body.encode()), {'sidebar'} | tags
+
+    return sidebar('bootstrap', compute)
+
+
+class Index(ConditionalGetMixin, PageCacheMixin, View):
     def get(self, request, page=1):
-        p = Post.objects.all().order_by('-date')
-        paginator = Paginator(p, 8)
-        try:
-            posts = paginator.page(page)
-        except EmptyPage:
-            posts = paginator.page(paginator.num_pages)
-        pinned = PinnedPost.objects.all()[0:3]
-        return render(request, 'blog/index.html', context={'posts': posts, 'pinned': pinned})
+        p = listing(Post.objects.all())
+        posts = cached_paginate(request, 'index', {'listing-index'}, p, 8, page)
+        pinned = tiered_cache.get_or_set(
+            'blog:pinned:' + page_cache.versions({'pinned'})['pinned'],
+            lambda: list(listing(Post.objects.filter(pinnedpost__isnull=False)).order_by('pinnedpost')[0:3]),
+            getattr(settings, 'BLOG_LISTING_CACHE_TTL', 60))
+        response = render(request, 'blog/index.html', context={'posts': posts, 'pinned': pinned})
+        return tagged(response, {'listing-index', 'pinned'} | post_tags(posts) | post_tags(pinned))
+
 
+class PostDetails(ConditionalGetMixin, PageCacheMixin, View):
+    def page_cache_hit(self, request, meta):
+        view_counter.incr(meta['post'])
+
+    def not_modified(self, request, slug):
+        for post_id in Post.objects.filter(slug=slug).values_list('id', flat=True)[:1]:
+            view_counter.incr(post_id)
 
-class PostDetails(View):
     def get(self, request, slug):
-        post = get_object_or_404(Post, slug=slug)
-        post.views += 1
-        post.save()
+        post = get_object_or_404(Post.objects.select_related('author', 'category').prefetch_related('tags'), slug=slug)
+        post.ensure_rendered()
+        view_counter.incr(post.id)
+        post.views += view_counter.pending(post.id)
+        thread = load_comments(post.id)
         if request.user.is_authenticated:
             is_liked = request.user.profile.likes.filter(slug=slug).count() > 0
             is_pinned = PinnedPost.objects.filter(post__slug=slug).count() > 0
             return render(request, 'blog/post_details.html', context={'post': post,
+                                                                      'thread': thread,
                                                                       'is_liked': is_liked,
                                                                       'is_pinned': is_pinned})
         else:
-            return render(request, 'blog/post_details.html', context={'post': post})
+            response = render(request, 'blog/post_details.html', context={'post': post, 'thread': thread})
+            tags = post_tags([post]) | {'tag-{}'.format(tag.id) for tag in post.tags.all()}
+            return tagged(response, tags, post=post.id)
+
+
+class PostComments(ConditionalGetMixin, View):
+    def get(self, request, slug):
+        post = get_object_or_404(Post.objects.only('id'), slug=slug)
+        try:
+            before = int(request.GET.get('before', ''))
+        except ValueError:
+            before = None
+        thread = load_comments(post.id, before=before)
+        response = {
+            'status': 'OK',
+            'html': render_to_string('blog/comment_list.html', context={'thread': thread}, request=request),
+            'next': thread.next_cursor
+        }
+        return tagged(JsonResponse(response), {'post-{}'.format(post.id)})
 
 
 class SendComment(LoginRequiredMixin, View):
@@ -77,52 +218,126 @@ class ReplyComment(LoginRequiredMixin, View):
         return redirect('post_details', slug=comment.post.slug)
 
 
-class TagsList(View):
+class TagsList(ConditionalGetMixin, View):
+    def per_user(self, request):
+        return False
+
     def get(self, request):
-        tags = Tag.objects.all()
-        data = [{'title': tag.title.lower(), 'url': tag.get_absolute_url()} for tag in tags]
+        data = sidebar_tags()
         response = {
             'status': 'OK',
             'data': data
         }
-        return JsonResponse(response)
+        return tagged(JsonResponse(response), {'sidebar'})
+
 
+class CategoriesList(ConditionalGetMixin, View):
+    def per_user(self, request):
+        return False
 
-class CategoriesList(View):
     def get(self, request):
-        categories = Category.objects.all()
-        data = [{'title': category.title,
-                 'url': category.get_absolute_url(),
-                 'posts_count': category.posts.count()}
-                for category in categories]
+        data = sidebar_categories()
         response = {
             'status': 'OK',
             'data': data
         }
-        return JsonResponse(response)
+        return tagged(JsonResponse(response), {'sidebar'})
+
+
+class Autocomplete(ConditionalGetMixin, View):
+    def per_user(self, request):
+        return False
 
+    def etag_extra(self, request):
+        # also changes with views, revalidated once the cached list may have been refreshed
+        return int(time.time() // getattr(settings, 'BLOG_AUTOCOMPLETE_TTL', 300))
 
-class PopularPosts(View):
     def get(self, request):
-        posts = Post.objects.filter(date__year=datetime.date.today().year,
-                                    date__month=datetime.date.today().month).order_by('-views')[0:3]
-        data = [{'title': post.title,
-                 'url': post.get_absolute_url(),
-                 'image': post.cover_small.url if post.cover_small else 'static/images/posts/default-post-image.jpg',
-                 'date': post.date.date().strftime(" %b. %d, %Y")}
-                for post in posts]
+        suggestions = autocomplete.suggest(request.GET.get('q', ''))
+        urls = {'posts': 'post_details', 'tags': 'tag_posts', 'categories': 'category_posts'}
+        data = {name: [{'title': title, 'url': reverse(urls[name], kwargs={'slug': slug})}
+                       for title, rank, slug in entries]
+                for name, entries in suggestions.items()}
+        # the suggestions are refreshed on the same saves as the sidebar
+        return tagged(JsonResponse({'status': 'OK', 'data': data}), {'sidebar'})
+
+
+class PopularPosts(ConditionalGetMixin, View):
+    def per_user(self, request):
+        return False
+
+    def etag_extra(self, request):
+        # also changes with views, revalidated once the cached list may have been refreshed
+        return int(time.time() // getattr(settings, 'BLOG_SIDEBAR_CACHE_TTL', 300))
+
+    def get(self, request):
+        window = request.GET.get('window', 'month')
+        data, tags = sidebar_popular_posts(window if window in TRENDING_WINDOWS else 'month')
         if len(data) > 0:
             response = {
                 'status': 'OK',
                 'data': data
             }
-            return JsonResponse(response)
+            return tagged(JsonResponse(response), {'sidebar'} | tags)
         else:
             response = {
                 'status': 'NOTFOUND',
                 'data': ''
             }
-            return JsonResponse(response)
+            return tagged(JsonResponse(response), {'sidebar'})
+
+
+class CacheStats(View):
+    def get(self, request):
+        if not request.user.is_staff:
+            raise PermissionDenied
+        response = {
+            'status': 'OK',
+            'data': {'tiered': tiered_cache.stats(), 'pages': page_cache.stats()}
+        }
+        return JsonResponse(response)
+
+
+class Bootstrap(ConditionalGetMixin, View):
+    """
+    Tags, categories and popular posts for the sidebar in one request.
+
+    The shared part is served as cached bytes, gzipped when the client accepts
+    it, and may be stored by any HTTP cache. With ?user=1 a logged in user also
+    gets the user panel, in a private response; anonymous visitors load the
+    sign in panel from user_info, since it carries their own CSRF token.
+    """
+
+    def per_user(self, request):
+        return 'user' in request.GET
+
+    def etag_extra(self, request):
+        return int(time.time() // getattr(settings, 'BLOG_SIDEBAR_CACHE_TTL', 300)), \
+            bool(ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+    def get(self, request):
+        data, body, compressed, tags = sidebar_bootstrap()
+        if 'user' in request.GET and request.user.is_authenticated:
+            user = Profile.objects.get(user=request.user)
+            panel = render_to_string('blog/user_info.html', context={'user': user}, request=request)
+            body = ('{"status": "OK", "data": ' + data + ', "user": ' + json.dumps(panel) + '}').encode()
+            compressed = None
+            max_age, private = 0, True
+        else:
+            max_age, private = getattr(settings, 'BLOG_SIDEBAR_CACHE_TTL', 300), False
+        response = HttpResponse(content_type='application/json')
+        if ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            response.content = compressed or gzip.compress(body)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response.content = body
+        patch_vary_headers(response, ('Accept-Encoding',))
+        tagged(response, tags)
+        if private:
+            patch_cache_control(response, private=True, max_age=max_age)
+        else:
+            patch_cache_control(response, public=True, max_age=max_age)
+        return response
 
 
 class UserInfo(View):
@@ -134,28 +349,24 @@ class UserInfo(View):
             return render(request, 'blog/auth_panel.html')
 
 
-class TagPosts(View):
+class TagPosts(ConditionalGetMixin, PageCacheMixin, View):
     def get(self, request, slug, page=1):
         tag = get_object_or_404(Tag, slug=slug)
-        p = tag.posts.all()
-        paginator = Paginator(p, 8)
-        try:
-            posts = paginator.page(page)
-        except EmptyPage:
-            posts = paginator.page(paginator.num_pages)
-        return render(request, 'blog/tag_posts.html', context={'posts': posts, 'tag': tag})
+        p = listing(tag.posts.all())
+        posts = cached_paginate(request, 'tag-{}'.format(tag.id), {'tag-{}-posts'.format(tag.id)}, p, 8, page)
+        response = render(request, 'blog/tag_posts.html', context={'posts': posts, 'tag': tag})
+        return tagged(response, {'tag-{}'.format(tag.id), 'tag-{}-posts'.format(tag.id)} | post_tags(posts))
 
 
-class CategoryPosts(View):
+class CategoryPosts(ConditionalGetMixin, PageCacheMixin, View):
     def get(self, request, slug, page=1):
         category = get_object_or_404(Category, slug=slug)
-        p = category.posts.all()
-        paginator = Paginator(p, 8)
-        try:
-            posts = paginator.page(page)
-        except EmptyPage:
-            posts = paginator.page(paginator.num_pages)
-        return render(request, 'blog/category_posts.html', context={'posts': posts, 'category': category})
+        p = listing(category.posts.all())
+        posts = cached_paginate(request, 'category-{}'.format(category.id), {'category-{}-posts'.format(category.id)},
+                                p, 8, page)
+        response = render(request, 'blog/category_posts.html', context={'posts': posts, 'category': category})
+        return tagged(response, {'category-{}'.format(category.id), 'category-{}-posts'.format(category.id)} |
+                      post_tags(posts))
 
 
 class MyAccount(LoginRequiredMixin, View):
@@ -192,59 +403,90 @@ class MyAccount(LoginRequiredMixin, View):
                                                              'status': 'Information successful updated!'})
 
 
-class UserAccount(View):
+class UserAccount(ConditionalGetMixin, PageCacheMixin, View):
     def get(self, request, username, page=1):
-        user = get_object_or_404(User, username__iexact=username)
-        p = Post.objects.filter(author=user.profile).order_by('-date')
-        paginator = Paginator(p, 8)
-        try:
-            posts = paginator.page(page)
-        except EmptyPage:
-            posts = paginator.page(paginator.num_pages)
-        return render(request, 'blog/user_account.html', context={'user': user, 'posts': posts})  # todo
-
-
-class UserFavoritePosts(LoginRequiredMixin, View):
+        user = get_object_or_404(User.objects.select_related('profile'), username__iexact=username)
+        p = listing(Post.objects.filter(author=user.profile))
+        posts = cached_paginate(request, 'author-{}'.format(user.profile.id), {'author-{}-posts'.format(user.profile.id)},
+                                p, 8, page)
+        response = render(request, 'blog/user_account.html', context={'user': user,
+                                                                      'posts': posts,
+                                                                      'count': posts.paginator.count})
+        return tagged(response, {'author-{}'.format(user.profile.id), 'author-{}-posts'.format(user.profile.id)} |
+                      post_tags(posts))
+
+
+class UserFavoritePosts(LoginRequiredMixin, ConditionalGetMixin, View):
     login_url = '/account/login/'
     redirect_field_name = 'from_url'
 
     def get(self, request, page):
         user = request.user.profile
-        p = user.likes.all()
-        count = p.count()
-        paginator = Paginator(p, 3)
-        try:
-            posts = paginator.page(page)
-        except EmptyPage:
-            posts = paginator.page(paginator.num_pages)
-        return render(request, 'blog/user_favorite_posts.html', context={'posts': posts, 'count': count})
+        p = listing(user.likes.all())
+        posts = paginate(request, p, 3, page)
+        return render(request, 'blog/user_favorite_posts.html', context={'posts': posts, 'count': posts.paginator.count})
 
 
-class UserPosts(LoginRequiredMixin, View):
+class UserPosts(LoginRequiredMixin, ConditionalGetMixin, View):
     login_url = '/account/login/'
     redirect_field_name = 'from_url'
 
     def get(self, request, page):
         user = request.user.profile
-        p = user.posts.all()
-        count = p.count()
-        paginator = Paginator(p, 3)
-        try:
-            posts = paginator.page(page)
-        except EmptyPage:
-            posts = paginator.page(paginator.num_pages)
-        return render(request, 'blog/user_posts.html', context={'posts': posts, 'count': count})
-
-
-class Search(View):
-    def get(self, request, query, page=1):
-        p = Post.objects.filter(Q(body__icontains=query) | Q(title__icontains=query))
-        paginator = Paginator(p, 8)
+        p = listing(user.posts.all())
+        posts = paginate(request, p, 3, page)
+        return render(request, 'blog/user_posts.html', context={'posts': posts, 'count': posts.paginator.count})
+
+
+def _facet_links(request, objects, counts, param, multiple):
+    selected = request.GET.getlist(param)
+    links = []
+    for obj in sorted(objects, key=lambda obj: (-counts[obj.id], obj.title)):
+        params = request.GET.copy()
+        active = obj.slug in selected
+        if active:
+            params.setlist(param, [slug for slug in selected if slug != obj.slug])
+        else:
+            params.setlist(param, selected + [obj.slug] if multiple else [obj.slug])
+        links.append({'title': obj.title, 'count': counts[obj.id], 'active': active,
+                      'url': '?' + params.urlencode()})
+    return links
+
+
+class Search(ConditionalGetMixin, View):
+    def get(self, request, query='', page=1):
+        index = get_index()
+        ids = index.search(query)
+        category = Category.objects.filter(slug=request.GET['category']).first() \
+            if request.GET.get('category') else None
+        tags = list(Tag.objects.filter(slug__in=request.GET.getlist('tag'))) if request.GET.get('tag') else []
+        ids = facets.filter(ids, category.id if category else None, [tag.id for tag in tags])
+        category_counts, tag_counts = facets.counts(ids)
+
+        paginator = Paginator(ids, 8)
         try:
             posts = paginator.page(page)
         except EmptyPage:
             posts = paginator.page(paginator.num_pages)
-        return render(request, 'blog/search.html', context={'posts': posts, 'query': query})
+        found = listing(Post.objects.filter(id__in=posts.object_list)).in_bulk()
+        highlights = index.highlight(query, posts.object_list)
+        posts.object_list = [found[pk] for pk in posts.object_list if pk in found]
+        for post in posts.object_list:
+            post.title_highlight, post.snippet = highlights.get(post.id, (post.title, None))
+        response = render(request, 'blog/search.html', context={
+            'posts': posts,
+            'query': query,
+            'filters': request.GET.urlencode(),
+            'category_facets': _facet_links(request, Category.objects.filter(id__in=category_counts),
+                                            category_counts, 'category', multiple=False),
+            'tag_facets': _facet_links(request, Tag.objects.filter(id__in=tag_counts),
+                                       tag_counts, 'tag', multiple=True),
+        })
+        # 'listing-index' is purged whenever a post is saved or deleted, which may change the matches
+        category_ids = set(category_counts) | ({category.id} if category else set())
+        tag_ids = set(tag_counts) | {tag.id for tag in tags}
+        return tagged(response, {'listing-index'} | post_tags(posts.object_list) |
+                      {'category-{}'.format(pk) for pk in category_ids} | {'tag-{}'.format(pk) for pk in tag_ids})
 
 
 class CreatePost(PermissionRequiredMixin, View):
@@ -296,15 +538,12 @@ class LikePost(LoginRequiredMixin, View):
     redirect_field_name = 'from_url'
 
     def post(self, request, slug):
-        if request.user.profile.likes.filter(slug=slug).count() == 0:
-            post = get_object_or_404(Post, slug=slug)
-            form = LikeForm({'post': post.id, 'profile': request.user.profile.id})
-        else:
-            post = get_object_or_404(Post, slug=slug)
-            form = UnlikeForm({'post': post.id, 'profile': request.user.profile.id})
-        if form.is_valid():
-            form.save()
-        return redirect(post.get_absolute_url())
+        post_id = get_object_or_404(Post.objects.values_list('id', flat=True), slug=slug)
+        liked = request.POST.get('liked')
+        liked, count = set_like(post_id, request.user.profile.id, None if liked is None else liked == '1')
+        if request.is_ajax():
+            return JsonResponse({'status': 'OK', 'liked': liked, 'count': count})
+        return redirect('post_details', slug=slug)
 
 
 class CreateCategory(PermissionRequiredMixin, View):
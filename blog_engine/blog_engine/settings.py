@@ -85,6 +85,30 @@ DATABASES = {
 }
 
 
+# Cache shared by every worker process: the page cache tag versions, the content and sidebar versions,
+# buffered views, the locks of blog.cache and the search and facet versions must be the same for all of
+# them. Set BLOG_MEMCACHED_LOCATION (host:port) to use memcached; without it every process has a cache
+# of its own (LocMemCache), which is fine for a single process but leaves the other workers serving
+# stale pages, see blog.checks
+if os.environ.get('BLOG_MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['BLOG_MEMCACHED_LOCATION'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# writes uploads, renditions, the search index and the purge log to a temporary directory,
+# and runs the tests on a cache of their own
+TEST_RUNNER = 'blog.testing.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -127,8 +151,93 @@ STATICFILES_DIRS = [
 
 STATIC_URL = '/static/'
 
+# collectstatic names the files by their content, STATIC_ROOT can be served with
+# Cache-Control: public, max-age=31536000, immutable and with the .gz and .br files next to them
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+STATICFILES_STORAGE = 'blog.staticfiles.CompressedManifestStorage'
+
+# Stylesheets collectstatic strips of the rules no class in the files under BLOG_STATIC_STRIP_CSS_CONTENT uses
+BLOG_STATIC_STRIP_CSS = ['css/bootstrap.css']
+# (templates, scripts and the Python code setting widget classes)
+BLOG_STATIC_STRIP_CSS_CONTENT = [os.path.join(BASE_DIR, 'templates'), os.path.join(BASE_DIR, 'static', 'js'),
+                                 os.path.join(BASE_DIR, 'blog')]
+
 IMAGEKIT_CACHEFILE_DIR = 'static/CACHE'
 
+# Renditions are generated in the background after the upload, see blog.renditions
+IMAGEKIT_DEFAULT_CACHEFILE_BACKEND = 'blog.renditions.ProcessPoolBackend'
+IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY = 'blog.renditions.Ahead'
+
+# Renditions are named by the content of their source, IMAGEKIT_CACHEFILE_DIR can be served
+# with Cache-Control: public, max-age=31536000, immutable
+IMAGEKIT_SPEC_CACHEFILE_NAMER = 'blog.images.content_hash_namer'
+
+# Uploads are streamed to disk in chunks, one over BLOG_UPLOAD_MAX_BYTES is cut off and rejected
+FILE_UPLOAD_HANDLERS = ['blog.uploads.CappedUploadHandler']
+BLOG_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+
+# Uploaded images with more pixels are rejected before they are decoded
+BLOG_UPLOAD_MAX_PIXELS = 50000000
+
+# Uploaded images are stored scaled down to fit in this many pixels a side, without their metadata
+BLOG_IMAGE_MAX_SIZE = 2560
+
+# Processes generating image renditions, 0 generates them in the process that saved the image
+BLOG_RENDITION_WORKERS = 2
+
+# Seconds between writes of buffered post views, 0 writes every view immediately
+BLOG_VIEWS_FLUSH_INTERVAL = 10
+
+# Comments rendered with a post, older ones are loaded on demand
+BLOG_COMMENTS_PAGE_SIZE = 20
+
+# Seconds the post counts shown next to paginated listings are cached for
+BLOG_PAGINATOR_COUNT_TTL = 300
+
+# Dotted path of the search backend, by default SQLite FTS5 when available and
+# blog.search.InvertedIndex otherwise
+BLOG_SEARCH_BACKEND = None
+
+# Where blog.search.InvertedIndex keeps its index
+BLOG_SEARCH_INDEX_PATH = os.path.join(BASE_DIR, 'search.idx')
+
+# Bytes of post ids journaled by blog.search.InvertedIndex before it writes the whole index again
+BLOG_SEARCH_JOURNAL_SIZE = 16384
+
+# Suggestions of each kind returned by /json/autocomplete/
+BLOG_AUTOCOMPLETE_LIMIT = 5
+
+# Only this many of the most viewed posts are suggested, bounding the index in memory
+BLOG_AUTOCOMPLETE_MAX_POSTS = 50000
+
+# Seconds before the suggestions are rebuilt to follow changes in views
+BLOG_AUTOCOMPLETE_TTL = 300
+
+# Seconds pages are cached for anonymous visitors, 0 turns the page cache off
+BLOG_PAGE_CACHE_TTL = 600
+
+# Entries kept by each process in front of the shared cache, and for how many seconds
+BLOG_LOCAL_CACHE_SIZE = 1024
+BLOG_LOCAL_CACHE_TTL = 5
+
+# Seconds the tag, category and popular post lists are cached for
+BLOG_SIDEBAR_CACHE_TTL = 300
+
+# Seconds a page of a post listing is cached for, how long comment and like counts may lag
+BLOG_LISTING_CACHE_TTL = 60
+
+# How much a view, a like and a comment or reply count towards the trending score of a post
+BLOG_TRENDING_WEIGHTS = {'view': 1, 'like': 5, 'comment': 10}
+
+# Trending scores decayed below this are dropped by compaction
+BLOG_TRENDING_MIN_SCORE = 0.01
+
+# Dotted path of the purger of the HTTP cache in front of the site: blog.purge.FilePurger
+# logs purges to BLOG_PURGE_LOG, blog.purge.HttpPurger sends them to BLOG_PURGE_URL
+BLOG_PURGER = 'blog.purge.FilePurger'
+BLOG_PURGE_LOG = os.path.join(BASE_DIR, 'purge.log')
+BLOG_PURGE_URL = 'http://127.0.0.1:6081/'
+
 
 EMAIL_HOST = 'smtp.yandex.ru'
 EMAIL_PORT = '465'